@@ -0,0 +1,239 @@
+# coding=utf-8
+"""
+Micro-benchmarks for some performance-sensitive parts of qthelpers (they are not unitary tests).
+Run all of them, or only some of them, with::
+
+    $ python benchmarks/run_benchmarks.py [attribute_access memory ...]
+
+Benchmarks only measure real code paths. Some of them compare two ways of doing the same thing with the current code
+(for example, `Formset.insert_item` in a loop and `Formset.extend`). `attribute_access` only uses APIs that already
+existed in the first versions of qthelpers: compare it with an older version by running this script against a
+checkout of this version::
+
+    $ git worktree add /tmp/qthelpers-old <old commit>
+    $ PYTHONPATH=/tmp/qthelpers-old python benchmarks/run_benchmarks.py attribute_access
+
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+__author__ = 'flanker'
+
+
+def bench(label: str, function, number: int=200000) -> float:
+    """ Print the duration of a call to `function` (without arguments), in ns """
+    duration = min(timeit.repeat(function, number=number, repeat=3))
+    print('%-56s %8.1f ns' % (label, duration * 1e9 / number))
+    return duration
+
+
+def get_application():
+    from PySide import QtGui
+    return QtGui.QApplication.instance() or QtGui.QApplication([])
+
+
+def bench_attribute_access():
+    from qthelpers.fields import CharField, IntegerField, ListField
+    from qthelpers.forms import BaseForm
+    from qthelpers.preferences import Preferences, Section
+
+    class BenchPreferences(Preferences):
+        organization_name = 'qthelpers'
+        verbose_name = 'benchmarks'
+
+        class GlobalInfos(Section):
+            last_documents = ListField(default=[])
+            auto_save_interval = IntegerField(default=0, min_value=0)
+
+    class BenchForm(BaseForm):
+        str_value = CharField(default='my_str')
+        int_value = IntegerField(default=42)
+
+    preferences = BenchPreferences()
+    form = BenchForm()
+
+    def write_value():
+        preferences.GlobalInfos.auto_save_interval = 10
+
+    bench('GlobalInfos.auto_save_interval (read)', lambda: preferences.GlobalInfos.auto_save_interval)
+    bench('GlobalInfos.last_documents (read)', lambda: preferences.GlobalInfos.last_documents)
+    bench('GlobalInfos.auto_save_interval (write)', write_value)
+    bench("preferences['GlobalInfos/auto_save_interval']", lambda: preferences['GlobalInfos/auto_save_interval'])
+    bench('Form method call', form.get_values)
+    bench('Form field read', lambda: form.int_value)
+
+
+def bench_preference_handles():
+    from qthelpers.fields import IntegerField
+    from qthelpers.preferences import Preferences, Section
+
+    class BenchPreferences(Preferences):
+        class GlobalInfos(Section):
+            auto_save_interval = IntegerField(default=0, min_value=0)
+
+    preferences = BenchPreferences()
+    handle = preferences.handle('GlobalInfos/auto_save_interval')
+    bench("[before] preferences['GlobalInfos/auto_save_interval']",
+          lambda: preferences['GlobalInfos/auto_save_interval'])
+    bench('[after]  handle.get()', handle.get)
+
+
+def bench_memory(number: int=10000):
+    from qthelpers.fields import CharField, IntegerField, FieldGroup, CompactFieldGroup
+
+    class Record(FieldGroup):
+        name = CharField(default='')
+        quantity = IntegerField(default=0)
+        price = IntegerField(default=0)
+
+    class CompactRecord(CompactFieldGroup):
+        __slots__ = ()
+        name = CharField(default='')
+        quantity = IntegerField(default=0)
+        price = IntegerField(default=0)
+
+    for cls in Record, CompactRecord:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        records = [cls(initial={'name': 'item', 'quantity': index}) for index in range(number)]
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('%-56s %8.1f bytes' % ('%s instance' % cls.__name__, (after - before) / len(records)))
+
+
+def get_formset_classes():
+    from qthelpers.fields import CharField, IntegerField
+    from qthelpers.forms import Formset, ModelFormset
+
+    class BenchFormset(Formset):
+        name = CharField(default='')
+        quantity = IntegerField(default=0)
+        price = IntegerField(default=0)
+
+    class RecyclingBenchFormset(BenchFormset):
+        recycle_widgets = True
+
+    class BenchModelFormset(ModelFormset):
+        name = CharField(default='')
+        quantity = IntegerField(default=0)
+        price = IntegerField(default=0)
+
+    return BenchFormset, RecyclingBenchFormset, BenchModelFormset
+
+
+def bench_formset_population(number: int=10000):
+    application = get_application()
+    formset_class, recycling_formset_class, model_formset_class = get_formset_classes()
+    rows = [{'name': 'item %d' % index, 'quantity': index, 'price': 2 * index} for index in range(number)]
+
+    def insert_items(formset):
+        for values in rows:
+            formset.insert_item(values)
+
+    for label, cls, populate in (
+            ('[before] Formset.insert_item', formset_class, insert_items),
+            ('[after]  Formset.extend', formset_class, lambda formset: formset.extend(rows)),
+            ('[after]  ModelFormset.extend', model_formset_class, lambda formset: formset.extend(rows)),
+    ):
+        formset = cls()
+        formset.show()
+        start = time.perf_counter()
+        populate(formset)
+        application.processEvents()
+        print('%-56s %8.1f ms' % ('%s (%d rows)' % (label, number), (time.perf_counter() - start) * 1e3))
+        formset.close()
+        formset.deleteLater()
+        application.processEvents()
+
+
+def bench_formset_churn(number: int=1000, item_count: int=20):
+    """ Add and remove items, as in a data-entry screen """
+    application = get_application()
+    formset_class, recycling_formset_class, model_formset_class = get_formset_classes()
+    for label, cls in (('[before] Formset', formset_class), ('[after]  Formset.recycle_widgets', recycling_formset_class)):
+        formset = cls(initial=[{}] * item_count)
+        formset.show()
+        start = time.perf_counter()
+        for index in range(number):
+            formset.insert_item({'name': 'item %d' % index}, index=0)
+            formset.remove_item(formset.topLevelItem(formset.topLevelItemCount() - 1))
+            application.processEvents()
+        duration = time.perf_counter() - start
+        print('%-56s %8.1f µs %s' % ('%s (add/remove)' % label, duration * 1e6 / number, formset.get_widget_counters()))
+        formset.close()
+        formset.deleteLater()
+        application.processEvents()
+
+
+def bench_long_form(number: int=2000):
+    from qthelpers.fields import IntegerField
+    from qthelpers.forms import Form, VirtualForm
+    application = get_application()
+    fields = {'value_%d' % index: IntegerField(default=index, verbose_name='Value %d' % index) for index in range(number)}
+    for label, base in (('[before] Form', Form), ('[after]  VirtualForm', VirtualForm)):
+        cls = type('LongForm', (base,), dict(fields))
+        tracemalloc.start()
+        start = time.perf_counter()
+        form = cls()
+        form.show()
+        application.processEvents()
+        duration = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('%-56s %8.1f ms %8.1f kB (%d widgets)' % ('%s (%d fields)' % (label, number), duration * 1e3,
+                                                      memory / 1024, len(form.get_widgets())))
+        form.close()
+        form.deleteLater()
+        application.processEvents()
+
+
+def bench_preferences_load(number: int=20000):
+    from qthelpers.fields import DictField, IntegerField
+    from qthelpers.preferences import Preferences, Section
+
+    directory = tempfile.mkdtemp()
+
+    class LargePreferences(Preferences):
+        class GlobalInfos(Section):
+            auto_save_interval = IntegerField(default=0, min_value=0)
+
+        class DocumentStates(Section):
+            states = DictField(max_depth=3)
+
+        def application_settings_filenames(self):
+            return os.path.join(directory, 'home.plist'), os.path.join(directory, 'allusers.plist')
+
+    def load_all():
+        preferences = LargePreferences()
+        preferences.load()
+        preferences.GlobalInfos.get_values()
+        preferences.DocumentStates.get_values()
+
+    def load_used():
+        preferences = LargePreferences()
+        preferences.load()
+        preferences.GlobalInfos.get_values()
+
+    try:
+        preferences = LargePreferences()
+        preferences.DocumentStates.states = {'document %d' % index: {'position': [index, 2 * index], 'zoom': 1.5}
+                                             for index in range(number)}
+        preferences.save()
+        preferences.flush()
+        for label, function in (('[before] load, all sections used', load_all),
+                                ('[after]  load, only GlobalInfos used', load_used)):
+            duration = min(timeit.repeat(function, number=1, repeat=5))
+            print('%-56s %8.1f ms' % (label, duration * 1e3))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or ['attribute_access', 'preference_handles', 'memory', 'formset_population',
+                                 'formset_churn', 'long_form', 'preferences_load']:
+        globals()['bench_%s' % name]()
@@ -7,7 +7,7 @@ from qthelpers import fields
 
 from qthelpers.menus import registered_menus, registered_menu_actions
 from qthelpers.preferences import Preferences, GlobalObject, global_dict, Section
-from qthelpers.shortcuts import get_icon, get_pixmap
+from qthelpers.shortcuts import get_icon, get_pixmap, critical
 from qthelpers.translation import ugettext as _
 
 __author__ = 'flanker'
@@ -92,13 +92,21 @@ class BaseApplication(Preferences):
 
     def exec_(self):
         self.application.exec_()
-        self.save()  # save preferences
+        self.save_preferences()
 
     def quit(self, *args, **kwargs):
         self.application.quit(*args, **kwargs)
-        self.save()  # save preferences
+        self.save_preferences()
         global_dict[application_key] = None
 
+    def save_preferences(self) -> None:
+        """ Save preferences and write them immediately (the application may exit just after), displaying errors """
+        self.save()
+        try:
+            self.flush()
+        except OSError as e:
+            critical(_('Unable to save preferences'), str(e), only_ok=True)
+
     def systray_message_clicked(self):
         pass
 
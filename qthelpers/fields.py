@@ -1,14 +1,23 @@
 # coding=utf-8
+import array
+import base64
 import functools
 import json
+import sys
 from PySide import QtGui, QtCore
 import itertools
 from qthelpers.exceptions import InvalidValueException
+from qthelpers.models import ChoiceListModel
 from qthelpers.shortcuts import create_button, get_icon
 from qthelpers.translation import ugettext as _
-from qthelpers.utils import p
+from qthelpers.utils import p, class_members, get_schema
 from qthelpers.widgets import FilepathWidget, ColorWidget, Button
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 __author__ = 'flanker'
 
 palette_valid = QtGui.QPalette()
@@ -16,32 +25,286 @@ palette_valid.setColor(QtGui.QPalette.Base, QtGui.QColor(147, 234, 154))
 palette_invalid = QtGui.QPalette()
 palette_invalid.setColor(QtGui.QPalette.Base, QtGui.QColor(207, 0, 0))
 
+_json_scalar_types = {str, int, float, bool, type(None)}
+_json_key_types = (str, int, float, bool, type(None))
+_json_base_types = {str: (str, ), int: (int, ), float: (float, int), bool: (bool, )}
+
+
+def _check_json_value(value, depth: int, budget: int) -> int:
+    """ Check that `value` is a JSON value, without serializing it.
+    :param depth: remaining allowed nesting level
+    :param budget: remaining allowed number of values
+    :return: the remaining budget, or -1 if `value` is not valid
+    """
+    budget -= 1
+    if budget < 0:
+        return -1
+    if value.__class__ in _json_scalar_types:
+        return budget
+    elif isinstance(value, (list, tuple)):
+        if depth <= 0:
+            return -1
+        for item in value:
+            budget = _check_json_value(item, depth - 1, budget)
+            if budget < 0:
+                return -1
+        return budget
+    elif isinstance(value, dict):
+        if depth <= 0:
+            return -1
+        for key, item in value.items():
+            if not isinstance(key, _json_key_types):
+                return -1
+            budget = _check_json_value(item, depth - 1, budget)
+            if budget < 0:
+                return -1
+        return budget
+    elif isinstance(value, (str, int, float)):  # subclasses, like enums
+        return budget
+    return -1
+
+
+def is_json_value(value, base_type: type=None, max_depth: int=None, max_size: int=None) -> bool:
+    """ Check that `value` can be serialized to JSON, without actually serializing it.
+
+    >>> is_json_value({'a': [1, 2.5, None, 'b', True]})
+    True
+    >>> is_json_value([1, {'b': set()}])
+    False
+    >>> is_json_value([1, 2, True], base_type=int)
+    False
+    >>> is_json_value([[[1]]], max_depth=2)
+    False
+
+    :param value: value to check
+    :param base_type: if `value` is a list or a tuple, the required type of its items (str, int, float or bool)
+    :param max_depth: maximum nesting level of lists and dicts (`None` for no limit)
+    :param max_size: maximum number of values, including nested ones (`None` for no limit)
+    :return: True if `value` is valid
+    """
+    if base_type in _json_base_types and isinstance(value, (list, tuple)):
+        allowed_types = _json_base_types[base_type]
+        if max_size is not None and len(value) >= max_size:
+            return False
+        for item in value:
+            if not isinstance(item, allowed_types) or (item.__class__ is bool and base_type is not bool):
+                return False
+        return max_depth is None or max_depth >= 1
+    try:
+        return _check_json_value(value, sys.maxsize if max_depth is None else max_depth,
+                                 sys.maxsize if max_size is None else max_size) >= 0
+    except RecursionError:  # too deep or circular references
+        return False
+
 
 class Field(object):
     _field_counter = itertools.count()
+    # constraints checked by the compiled validator (see compile_validator)
+    required = False
+    min_value = None
+    max_value = None
+    min_length = None
+    max_length = None
+    # expected type of values. When the class defining check_base_type also defines valid_type, the type check is
+    # done by the compiled validator instead of calling check_base_type.
+    valid_type = None
+    none_is_valid_type = False
+    invalid_type_message = None
+    required_message = _('no value provided')
+    min_value_message = _('value must be greater than %(m)d')
+    max_value_message = _('value must be smaller than %(m)d')
+    min_length_message = _('value must be at least %(m)d character long')
+    max_length_message = _('value must be at most %(m)d character long')
+    serialized_as_text = True  # False if `serialize` returns a JSON value instead of a string
+    computed = False  # True for fields computed from other fields (see ComputedField)
 
     def __init__(self, verbose_name='', help_text=None, default=None, disabled=False, validators=None, on_change=None):
+        """
+        :param validators: list of extra callable(value), raising InvalidValueException for invalid values
+        """
         self.verbose_name = verbose_name
         self.name = None
         self.help_text = help_text
         self.default = default
-        if validators is None:
-            validators = []
-        validators.insert(0, self.check_base_type)
-        self.validators = validators
+        self._validate = None
+        self._validate_many = None
+        self.validators = list(validators) if validators else []
         self.disabled = disabled
         self.on_change = on_change
         self.group_field_order = next(Field._field_counter)
 
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        # noinspection PyProtectedMember
+        return instance._values[self.name]
+
+    def __set__(self, instance, value):
+        self.is_valid(value)
+        # noinspection PyProtectedMember
+        instance._values[self.name] = value
+        # noinspection PyProtectedMember
+        if instance._track_changes or self.name in instance._dependents:
+            # noinspection PyProtectedMember
+            instance._field_changed(self.name)
+
     @property
     def label(self):
         return self.verbose_name
 
+    @property
+    def validators(self) -> list:
+        return self._validators
+
+    @validators.setter
+    def validators(self, validators: list):
+        self._validators = validators
+        self._validate = None
+        self._validate_many = None
+
     def is_valid(self, value) -> bool:
-        if self.validators is not None:
-            for validator in self.validators:
-                validator(value)
-        return True
+        validate = self._validate
+        if validate is None:
+            validate = self.compile_validator()
+        return validate(value)
+
+    def validate_many(self, values) -> dict:
+        """ Validate a whole column of values in a single call.
+        :param values: iterable of values
+        :return: dict {index: error message} of the invalid values (empty if all values are valid)
+        """
+        validate_many = self._validate_many
+        if validate_many is None:
+            self.compile_validator()
+            validate_many = self._validate_many
+        return validate_many(values)
+
+    def compile_validator(self):
+        """ Build the validation functions of this field, checking its type, required value, range, length and extra
+        validators. The constraints of this field are bound to a single closure, without any loop over the checks.
+        Automatically called on the first validation and when `validators` is replaced: call it again if other
+        constraints are modified afterwards. Validators appended to `validators` are always checked.
+        :return: the validation function, raising InvalidValueException for invalid values
+        """
+        inline_type = self._has_inline_type_check()
+        valid_type, none_is_valid, type_message = self.valid_type, self.none_is_valid_type, self.invalid_type_message
+        check_base_type = None if inline_type else self.check_base_type
+        required, required_message = self.required, self.required_message
+        min_value, max_value, min_length, max_length = self.min_value, self.max_value, self.min_length, self.max_length
+        has_value_range = min_value is not None or max_value is not None
+        has_length_range = min_length is not None or max_length is not None
+        min_value_message = None if min_value is None else self.min_value_message % {'m': min_value}
+        max_value_message = None if max_value is None else self.max_value_message % {'m': max_value}
+        min_length_message = None if min_length is None else self.min_length_message % {'m': min_length}
+        max_length_message = None if max_length is None else self.max_length_message % {'m': max_length}
+        validators = self._validators
+
+        if inline_type and not required and not has_value_range and not has_length_range:
+            def validate(value):
+                if not isinstance(value, valid_type) and not (none_is_valid and value is None):
+                    raise InvalidValueException(type_message)
+                if validators:
+                    for validator in validators:
+                        validator(value)
+                return True
+        elif inline_type and not has_length_range:
+            def validate(value):
+                if value is None:
+                    if not none_is_valid:
+                        raise InvalidValueException(type_message)
+                    if required:
+                        raise InvalidValueException(required_message)
+                elif not isinstance(value, valid_type):
+                    raise InvalidValueException(type_message)
+                elif has_value_range:
+                    if min_value is not None and value < min_value:
+                        raise InvalidValueException(min_value_message)
+                    if max_value is not None and value > max_value:
+                        raise InvalidValueException(max_value_message)
+                if validators:
+                    for validator in validators:
+                        validator(value)
+                return True
+        else:
+            def validate(value):
+                if check_base_type is not None:
+                    check_base_type(value)
+                elif not isinstance(value, valid_type) and not (none_is_valid and value is None):
+                    raise InvalidValueException(type_message)
+                if value is None:
+                    if required:
+                        raise InvalidValueException(required_message)
+                else:
+                    if min_value is not None and value < min_value:
+                        raise InvalidValueException(min_value_message)
+                    if max_value is not None and value > max_value:
+                        raise InvalidValueException(max_value_message)
+                    if min_length is not None and len(value) < min_length:
+                        raise InvalidValueException(min_length_message)
+                    if max_length is not None and len(value) > max_length:
+                        raise InvalidValueException(max_length_message)
+                if validators:
+                    for validator in validators:
+                        validator(value)
+                return True
+
+        def validate_many(values):
+            # each constraint is checked on the whole column, only the first error of each value is kept
+            values = values if isinstance(values, (list, tuple)) else list(values)
+            indexes = range(len(values))
+            if check_base_type is None:
+                errors = {index: type_message for (index, value) in enumerate(values)
+                          if not isinstance(value, valid_type) and not (none_is_valid and value is None)}
+            else:
+                errors = {}
+                for index in indexes:
+                    try:
+                        check_base_type(values[index])
+                    except InvalidValueException as e:
+                        errors[index] = str(e)
+            if required:
+                for index in indexes:
+                    if values[index] is None:
+                        errors.setdefault(index, required_message)
+            if min_value is not None:
+                for index in indexes:
+                    value = values[index]
+                    if value is not None and index not in errors and value < min_value:
+                        errors[index] = min_value_message
+            if max_value is not None:
+                for index in indexes:
+                    value = values[index]
+                    if value is not None and index not in errors and value > max_value:
+                        errors[index] = max_value_message
+            if min_length is not None:
+                for index in indexes:
+                    value = values[index]
+                    if value is not None and index not in errors and len(value) < min_length:
+                        errors[index] = min_length_message
+            if max_length is not None:
+                for index in indexes:
+                    value = values[index]
+                    if value is not None and index not in errors and len(value) > max_length:
+                        errors[index] = max_length_message
+            if validators:
+                for index in indexes:
+                    if index not in errors:
+                        try:
+                            for validator in validators:
+                                validator(values[index])
+                        except InvalidValueException as e:
+                            errors[index] = str(e)
+            return errors
+
+        self._validate = validate
+        self._validate_many = validate_many
+        return validate
+
+    def _has_inline_type_check(self) -> bool:
+        for cls in self.__class__.__mro__:
+            if 'check_base_type' in cls.__dict__:
+                return cls.__dict__.get('valid_type') is not None
+        return False
 
     def check_base_type(self, value) -> None:
         raise NotImplementedError
@@ -64,6 +327,33 @@ class Field(object):
     def set_widget_valid(self, widget, valid: bool, msg: str):
         raise NotImplementedError
 
+    def get_change_signal(self, widget):
+        """ Return the Qt signal emitted by `widget` when its value is modified by the user, or None """
+        return None
+
+    def get_display_value(self, value) -> str:
+        """ Return the text displaying `value` when no widget is used (for example, in a table view) """
+        if value is None:
+            return ''
+        return str(value)
+
+    def get_sort_key(self, value):
+        """ Return a key for sorting values of this field (all keys of a field must be comparable) """
+        return self.get_display_value(value).lower()
+
+    def to_text(self, value) -> str:
+        """ Convert `value` to a string, for CSV files or the clipboard """
+        value = self.serialize(value)
+        if not self.serialized_as_text:
+            return json.dumps(value)
+        return '' if value is None else value
+
+    def from_text(self, text: str):
+        """ Inverse of `to_text`. Raise ValueError for invalid texts. """
+        if not self.serialized_as_text:
+            return self.deserialize(json.loads(text)) if text else self.default
+        return self.deserialize(text)
+
     def _on_change(self, on_change: callable, group, widget):
         value = self.get_widget_value(widget)
         on_change(group, widget, value)
@@ -114,21 +404,14 @@ class ButtonField(IndexedButtonField):
 
 
 class CharField(Field):
+    valid_type = str
+    invalid_type_message = _('value must be a string')
+
     def __init__(self, verbose_name='', help_text=None, default=None, disabled=False, validators=None,
                  widget_validator=None, max_length=None, min_length=None, on_change=None):
-        if validators is None:
-            validators = []
-        if min_length is not None:
-            def valid_min(value):
-                if value is not None and len(value) < min_length:
-                    raise InvalidValueException(_('value must be at least %(m)d character long') % {'m': min_length})
-            validators.append(valid_min)
-        if max_length is not None:
-            def valid_max(value):
-                if value is not None and len(value) > max_length:
-                    raise InvalidValueException(_('value must be at most %(m)d character long') % {'m': min_length})
-            validators.append(valid_max)
         super().__init__(verbose_name, help_text, default, disabled, validators, on_change=on_change)
+        self.min_length = min_length
+        self.max_length = max_length
         self.widget_validator = widget_validator
 
     def check_base_type(self, value):
@@ -160,6 +443,12 @@ class CharField(Field):
     def set_widget_valid(self, widget, valid: bool, msg: str):
         widget.setPalette(palette_valid if valid else palette_invalid)
 
+    def get_change_signal(self, widget):
+        return widget.textChanged
+
+    def get_sort_key(self, value):
+        return (value or '').lower()
+
 
 class PasswordField(CharField):
 
@@ -169,6 +458,9 @@ class PasswordField(CharField):
         return editor
 
 class LabelField(Field):
+    valid_type = str
+    invalid_type_message = _('value must be a string')
+
     def __init__(self, verbose_name='', help_text=None, default=None, disabled=False):
         super().__init__(verbose_name, help_text, default, disabled, validators=[], on_change=None)
 
@@ -198,6 +490,9 @@ class LabelField(Field):
     def set_widget_valid(self, widget, valid: bool, msg: str):
         widget.setPalette(palette_valid if valid else palette_invalid)
 
+    def get_change_signal(self, widget):
+        return None
+
 
 class TextField(CharField):
     def get_widget(self, field_group, parent=None):
@@ -209,25 +504,17 @@ class TextField(CharField):
 
 
 class IntegerField(Field):
+    valid_type = int
+    none_is_valid_type = True
+    invalid_type_message = _('value must be a integer')
+
     def __init__(self, verbose_name='', help_text=None, default=None, disabled=False, validators=None,
                  widget_validator=None, min_value=None, max_value=None, required=True, on_change=None):
-        if validators is None:
-            validators = []
-        if min_value is not None:
-            def valid_min(value):
-                if value is not None and value < min_value:
-                    raise InvalidValueException(_('value must be greater than %(m)d') % {'m': min_value})
-            validators.append(valid_min)
-        if max_value is not None:
-            def valid_max(value):
-                if value is not None and value > max_value:
-                    raise InvalidValueException(_('value must be smaller than %(m)d') % {'m': max_value})
-            validators.append(valid_max)
-        if required:
-            validators.insert(0, self.check_required)
         super().__init__(verbose_name, help_text, default, disabled, validators, on_change=on_change)
         widget_validator = self.default_widget_validator(max_value, min_value, widget_validator)
         self.widget_validator = widget_validator
+        self.min_value = min_value
+        self.max_value = max_value
         self.required = required
 
     def serialize(self, value) -> str:
@@ -263,6 +550,12 @@ class IntegerField(Field):
     def set_widget_valid(self, widget, valid: bool, msg: str):
         widget.setPalette(palette_valid if valid else palette_invalid)
 
+    def get_change_signal(self, widget):
+        return widget.textChanged
+
+    def get_sort_key(self, value):
+        return (value is None, 0 if value is None else value)
+
     @staticmethod
     def default_widget_validator(max_value, min_value, widget_validator):
         if widget_validator is None:
@@ -288,6 +581,9 @@ class IntegerField(Field):
 
 
 class FloatField(IntegerField):
+    valid_type = float
+    none_is_valid_type = True
+    invalid_type_message = _('value must be a float')
 
     def deserialize(self, value: str):
         if value == '':
@@ -326,6 +622,9 @@ class FloatField(IntegerField):
 
 
 class BooleanField(Field):
+    serialized_as_text = False
+    valid_type = bool
+    invalid_type_message = _('Value must be a boolean')
 
     def serialize(self, value: bool) -> bool:
         return bool(value)
@@ -352,6 +651,15 @@ class BooleanField(Field):
     def set_widget_valid(self, widget, valid: bool, msg: str):
         pass
 
+    def get_change_signal(self, widget):
+        return widget.stateChanged
+
+    def get_display_value(self, value) -> str:
+        return _('Yes') if value else _('No')
+
+    def get_sort_key(self, value):
+        return bool(value)
+
     def check_base_type(self, value):
         if not isinstance(value, bool):
             raise InvalidValueException(_('Value must be a boolean'))
@@ -364,10 +672,6 @@ class BooleanField(Field):
 class FilepathField(CharField):
     def __init__(self, verbose_name: str='', help_text: str=None, default: str=None, disabled: bool=False,
                  validators: list=None, selection_filter: str=None, required=True, on_change=None):
-        if validators is None:
-            validators = []
-        if required:
-            validators.insert(0, self.check_required)
         self.required = required
         super().__init__(verbose_name=verbose_name, help_text=help_text, default=default, disabled=disabled,
                          validators=validators, on_change=on_change)
@@ -389,6 +693,9 @@ class FilepathField(CharField):
     def set_widget_valid(self, widget: FilepathWidget, valid: bool, msg: str):
         widget.setPalette(palette_valid if valid else palette_invalid)
 
+    def get_change_signal(self, widget):
+        return widget.line_editor.textChanged
+
     def set_widget_value(self, widget: FilepathWidget, value: str):
         widget.set_value(value)
 
@@ -396,10 +703,6 @@ class FilepathField(CharField):
 class ColorField(CharField):
     def __init__(self, verbose_name: str='', help_text: str=None, default: str=None, disabled: bool=False,
                  validators: list=None, required=True, on_change=None):
-        if validators is None:
-            validators = []
-        if required:
-            validators.insert(0, self.check_required)
         self.required = required
         super().__init__(verbose_name=verbose_name, help_text=help_text, default=default, disabled=disabled,
                          validators=validators, on_change=on_change)
@@ -420,30 +723,32 @@ class ColorField(CharField):
     def set_widget_valid(self, widget: ColorWidget, valid: bool, msg: str):
         widget.setPalette(palette_valid if valid else palette_invalid)
 
+    def get_change_signal(self, widget):
+        return widget.line_editor.textChanged
+
     def set_widget_value(self, widget: ColorWidget, value: str):
         widget.set_value(value)
 
 
 class ListField(Field):
+    serialized_as_text = False
+    min_length_message = _('list must count at least %(m)d values')
+    max_length_message = _('list must count at most %(m)d values')
+
     def __init__(self, verbose_name='', help_text=None, default=None, disabled=False, validators=None,
-                 base_type=None, min_length=None, max_length=None, on_change=None):
+                 base_type=None, min_length=None, max_length=None, on_change=None, max_depth=None, max_size=None):
+        """
+        :param base_type: type of the list items (str, int, float or bool), or None for any JSON value
+        :param max_depth: maximum nesting level of the list (None for no limit)
+        :param max_size: maximum total number of values, including nested ones (None for no limit)
+        """
         self.min_length = min_length
         self.max_length = max_length
         self.base_type = base_type
+        self.max_depth = max_depth
+        self.max_size = max_size
         if default is None:
             default = []
-        if validators is None:
-            validators = []
-        if min_length is not None:
-            def valid_min(value):
-                if value is not None and len(value) < min_length:
-                    raise InvalidValueException(_('list must count at least %(m)d values') % {'m': min_length})
-            validators.append(valid_min)
-        if max_length is not None:
-            def valid_max(value):
-                if value is not None and len(value) > max_length:
-                    raise InvalidValueException(_('list must count at most %(m)d values') % {'m': min_length})
-            validators.append(valid_max)
         super().__init__(verbose_name=verbose_name, help_text=help_text, disabled=disabled, validators=validators,
                          default=default, on_change=on_change)
 
@@ -479,24 +784,120 @@ class ListField(Field):
         return values
 
     def set_widget_value(self, widget, value: list):
-        widget.setText(','.join([str(x) for x in value]))
+        widget.setText(self.get_display_value(value))
+
+    def get_display_value(self, value) -> str:
+        return ','.join([str(x) for x in value])
 
     def set_widget_valid(self, widget, valid: bool, msg: str):
         widget.setPalette(palette_valid if valid else palette_invalid)
 
+    def get_change_signal(self, widget):
+        return widget.textChanged
+
     def check_base_type(self, value):
         if not isinstance(value, list) and not isinstance(value, tuple):
             raise InvalidValueException(_('Value must be a list or tuple of base JSON types'))
-        if self.base_type in (str, int, float, bool):
-            pass
-        try:
-            json.dumps(value)
-        except TypeError:
+        if not is_json_value(value, base_type=self.base_type, max_depth=self.max_depth, max_size=self.max_size):
             raise InvalidValueException(_('Value must be a list of base JSON types'))
 
 
+class ArrayListField(ListField):
+    """ List of numbers, stored in a compact array instead of a list of Python numbers.
+    Values are `array.array` objects (or one-dimensional NumPy arrays with `use_numpy=True`, when NumPy is installed),
+    and are serialized as a base64 string of their little-endian binary representation.
+    Lists of numbers (as serialized by a :class:`ListField`) are still accepted by :meth:`deserialize`.
+    """
+    serialized_as_text = True
+    typecodes = {int: 'q', float: 'd'}
+    numpy_dtypes = {int: '<i8', float: '<f8'}
+
+    def __init__(self, verbose_name='', help_text=None, default=None, disabled=False, validators=None,
+                 base_type=float, min_length=None, max_length=None, on_change=None, use_numpy=False):
+        """
+        :param base_type: int or float
+        :param use_numpy: store values as NumPy arrays (ignored if NumPy is not installed)
+        """
+        if base_type not in self.typecodes:
+            raise InvalidValueException(_('‘base_type’ must be int or float.'))
+        self.use_numpy = use_numpy and numpy is not None
+        self.typecode = self.typecodes[base_type]
+        super().__init__(verbose_name=verbose_name, help_text=help_text, default=default, disabled=disabled,
+                         validators=validators, base_type=base_type, min_length=min_length, max_length=max_length,
+                         on_change=on_change)
+
+    @property
+    def default(self):
+        """ Copy of the default array: arrays are mutable and must not be shared between field holders """
+        return self.to_array(self._default)
+
+    @default.setter
+    def default(self, default):
+        self._default = self.to_array(default)
+
+    def to_array(self, values):
+        """ Convert an iterable of numbers to the array type of this field """
+        if self.use_numpy:
+            return numpy.array(values, dtype=self.numpy_dtypes[self.base_type])
+        return array.array(self.typecode, values)
+
+    def serialize(self, value) -> str:
+        if self.use_numpy:
+            data = value.astype(self.numpy_dtypes[self.base_type], copy=False).tobytes()
+        elif sys.byteorder == 'big':
+            value = array.array(self.typecode, value)
+            value.byteswap()
+            data = value.tobytes()
+        else:
+            data = value.tobytes()
+        return base64.b64encode(data).decode('ascii')
+
+    def deserialize(self, value):
+        if isinstance(value, (list, tuple)):
+            return self.to_array(value)
+        data = base64.b64decode(value.encode('ascii'))
+        if self.use_numpy:
+            return numpy.frombuffer(data, dtype=self.numpy_dtypes[self.base_type]).copy()
+        result = array.array(self.typecode)
+        result.frombytes(data)
+        if sys.byteorder == 'big':
+            result.byteswap()
+        return result
+
+    def get_widget_value(self, widget):
+        value = widget.text()
+        if not value:
+            return self.to_array([])
+        if self.use_numpy:
+            return numpy.array(value.split(','), dtype=self.numpy_dtypes[self.base_type])
+        return array.array(self.typecode, map(self.base_type, value.split(',')))
+
+    def set_widget_value(self, widget, value):
+        widget.setText(self.get_display_value(value))
+
+    def get_display_value(self, value) -> str:
+        return ','.join(map(str, value.tolist()))
+
+    def check_base_type(self, value):
+        if isinstance(value, array.array) and value.typecode == self.typecode:
+            return
+        elif numpy is not None and isinstance(value, numpy.ndarray) and value.ndim == 1 and \
+                value.dtype.kind == ('i' if self.base_type == int else 'f'):
+            return
+        raise InvalidValueException(_('Value must be an array of numbers'))
+
+
 class DictField(Field):
-    def __init__(self, verbose_name='', help_text=None, default=None, disabled=False, validators=None, on_change=None):
+    serialized_as_text = False
+
+    def __init__(self, verbose_name='', help_text=None, default=None, disabled=False, validators=None, on_change=None,
+                 max_depth=None, max_size=None):
+        """
+        :param max_depth: maximum nesting level of the dict (None for no limit)
+        :param max_size: maximum total number of values, including nested ones (None for no limit)
+        """
+        self.max_depth = max_depth
+        self.max_size = max_size
         if default is None:
             default = {}
         super().__init__(verbose_name=verbose_name, help_text=help_text, disabled=disabled, validators=validators,
@@ -509,22 +910,44 @@ class DictField(Field):
         return value
 
     def check_base_type(self, value):
-        if not isinstance(value, dict):
-            raise InvalidValueException(_('Value must be a dict of standard JSON types'))
-        try:
-            json.dumps(value)
-        except TypeError:
+        if not isinstance(value, dict) or not is_json_value(value, max_depth=self.max_depth, max_size=self.max_size):
             raise InvalidValueException(_('Value must be a dict of standard JSON types'))
 
 
 class ChoiceField(Field):
+    serialized_as_text = False
+
     def __init__(self, verbose_name='', help_text=None, default=None, disabled=False, validators=None,
-                 choices=None, on_change=None):
+                 choices=None, on_change=None, use_model=False, filter_completer=False):
+        """
+        :param choices: list of (value, text)
+        :param use_model: display choices through a single ChoiceListModel, shared by all widgets of this field,
+            instead of adding each choice to each widget. Recommended for very large lists of choices.
+        :param filter_completer: (with `use_model`) make the combobox editable, with a popup completer filtering
+            choices as the user types
+        """
         super().__init__(verbose_name=verbose_name, help_text=help_text, disabled=disabled, validators=validators,
                          default=default, on_change=on_change)
         if choices is None:
             raise InvalidValueException(_('You must provide a list of tuples for ‘choices’ argument.'))
         self.choices = choices
+        self.use_model = use_model or filter_completer
+        self.filter_completer = filter_completer
+        self._model = None
+        self._completer_model = None
+
+    def get_model(self) -> ChoiceListModel:
+        """ Return the model shared by all widgets of this field, built on the first call """
+        if self._model is None:
+            self._model = ChoiceListModel(self.choices)
+        return self._model
+
+    def _get_completer_model(self) -> ChoiceListModel:
+        # choices sorted by text, allowing the completer to use a binary search instead of a linear scan
+        if self._completer_model is None:
+            choices = sorted(self.choices, key=lambda x: str(x[1]).lower())
+            self._completer_model = ChoiceListModel(choices)
+        return self._completer_model
 
     def serialize(self, value: object) -> object:
         return value
@@ -534,15 +957,36 @@ class ChoiceField(Field):
 
     def get_widget(self, field_group, parent=None):
         widget = QtGui.QComboBox(p(parent))
-        for value, text_value in self.choices:
-            widget.addItem(text_value, value)
+        if self.use_model:
+            model = self.get_model()
+            widget.setModel(model)
+            if self.filter_completer:
+                widget.setEditable(True)
+                widget.setInsertPolicy(QtGui.QComboBox.NoInsert)
+                completer = QtGui.QCompleter(self._get_completer_model(), widget)
+                completer.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
+                completer.setModelSorting(QtGui.QCompleter.CaseInsensitivelySortedModel)
+                completer.setCompletionMode(QtGui.QCompleter.PopupCompletion)
+                # noinspection PyUnresolvedReferences
+                completer.activated[str].connect(lambda text: widget.setCurrentIndex(model.row_of_text(text)))
+                widget.setCompleter(completer)
+        else:
+            for value, text_value in self.choices:
+                widget.addItem(text_value, value)
         widget.setDisabled(self.disabled)
         return widget
 
     def get_widget_value(self, widget: QtGui.QComboBox):
+        if self.use_model:
+            return self.get_model().value(widget.currentIndex())
         return widget.itemData(widget.currentIndex(), QtCore.Qt.UserRole)
 
     def set_widget_value(self, widget: QtGui.QComboBox, value):
+        if self.use_model:
+            row = self.get_model().row_of_value(value)
+            if row >= 0:
+                widget.setCurrentIndex(row)
+            return
         for index, item in enumerate(self.choices):
             if item[0] == value:
                 widget.setCurrentIndex(index)
@@ -550,14 +994,203 @@ class ChoiceField(Field):
     def set_widget_valid(self, widget, valid: bool, msg: str):
         widget.setPalette(palette_valid if valid else palette_invalid)
 
+    def get_change_signal(self, widget: QtGui.QComboBox):
+        return widget.currentIndexChanged
+
+    def get_display_value(self, value) -> str:
+        model = self.get_model()
+        return str(model.text(model.row_of_value(value)) or '')
+
+    def from_text(self, text: str):
+        # a choice can also be given by its displayed text (for example, when pasted from a spreadsheet)
+        model = self.get_model()
+        row = model.row_of_text(text)
+        if row >= 0:
+            return model.value(row)
+        return super().from_text(text)
+
     def check_base_type(self, value):
-        try:
-            json.dumps(value)
-        except TypeError:
+        if not is_json_value(value):
             raise InvalidValueException(_('Value must be a list of base JSON types'))
 
 
+_stale_value = object()  # value of a ComputedField that must be computed again
+
+
+class ComputedField(Field):
+    """ Read-only field, computed from other fields of the same group (including other computed fields).
+    The value is computed when it is read, and kept until one of its dependencies is modified.
+
+    >>> class Rectangle(FieldGroup):
+    ...     width = IntegerField(default=2)
+    ...     height = IntegerField(default=3)
+    ...     area = ComputedField(lambda width, height: width * height, depends_on=('width', 'height'))
+    >>> rectangle = Rectangle()
+    >>> rectangle.area
+    6
+    >>> rectangle.width = 5
+    >>> rectangle.area
+    15
+    """
+    computed = True
+    serialized_as_text = False
+
+    def __init__(self, compute: callable, depends_on, verbose_name='', help_text=None):
+        """
+        :param compute: callable receiving the values of the `depends_on` fields (in the same order)
+        :param depends_on: names of the fields used by `compute`
+        """
+        super().__init__(verbose_name=verbose_name, help_text=help_text, default=_stale_value, disabled=True)
+        self.compute = compute
+        self.depends_on = tuple(depends_on)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        # noinspection PyProtectedMember
+        value = instance._values[self.name]
+        if value is _stale_value:
+            value = self.compute(*[getattr(instance, field_name) for field_name in self.depends_on])
+            # noinspection PyProtectedMember
+            instance._values[self.name] = value
+        return value
+
+    def __set__(self, instance, value):
+        raise AttributeError(_('%(f)s is a computed field') % {'f': self.name})
+
+    def check_base_type(self, value):
+        pass
+
+    def serialize(self, value):
+        return value
+
+    def deserialize(self, value):
+        return value
+
+    def get_widget(self, field_group, parent=None):
+        editor = QtGui.QLineEdit(p(parent))
+        editor.setReadOnly(True)
+        if self.help_text is not None:
+            editor.setToolTip(self.help_text)
+        return editor
+
+    def get_widget_value(self, widget):
+        return None
+
+    def set_widget_value(self, widget, value):
+        widget.setText(self.get_display_value(value))
+
+    def set_widget_valid(self, widget, valid: bool, msg: str):
+        pass
+
+
+class CompactValues(list):
+    """ Values of a compact :class:`FieldGroup`, stored as a list indexed by the position of each field.
+    Values can also be read or written by field name, like with the default dict storage.
+    A subclass (with the right `_positions`) is created for each compact FieldGroup class.
+    """
+    __slots__ = ()
+    _positions = {}
+    """:type: dict of [str, int]"""
+
+    def __getitem__(self, key):
+        if key.__class__ is str:
+            key = self._positions[key]
+        return list.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        if key.__class__ is str:
+            key = self._positions[key]
+        list.__setitem__(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def get(self, key, default=None):
+        if key in self._positions:
+            return list.__getitem__(self, self._positions[key])
+        return default
+
+    def keys(self):
+        return self._positions.keys()
+
+    def items(self):
+        return zip(self._positions, self)
+
+
+class FieldGroupSchema(object):
+    """ Description of the fields of a :class:`FieldGroup` subclass.
+    Computed once per class by :meth:`FieldGroup._get_schema` and shared by all its instances.
+    """
+
+    def __init__(self, cls: type):
+        self.fields = {}
+        """:type: dict of [str, Field]"""
+        fields = []
+        for field_name, field in class_members(cls, lambda name, value: isinstance(value, Field)):
+            self.fields[field_name] = field
+            field.name = field_name
+            fields.append((field.group_field_order, field_name))
+        fields.sort()
+        self.field_order = [f[1] for f in fields]
+        self.computed_fields = self._sort_computed_fields()
+        """:type: list of str"""
+        # {field name: computed fields depending (directly or not) on it, in the order they must be computed}
+        self.dependents = {}
+        dependencies = {}  # {computed field name: all fields it depends on, directly or not}
+        for field_name in self.computed_fields:
+            dependencies[field_name] = set()
+            for dependency in self.fields[field_name].depends_on:
+                dependencies[field_name].add(dependency)
+                dependencies[field_name] |= dependencies.get(dependency, set())
+            for dependency in dependencies[field_name]:
+                self.dependents.setdefault(dependency, []).append(field_name)
+        self.values_class = None
+        if getattr(cls, 'compact_storage', False):  # formsets are not FieldGroups
+            positions = {field_name: position for (position, field_name) in enumerate(self.field_order)}
+            self.values_class = type('%sValues' % cls.__name__, (CompactValues, ),
+                                     {'__slots__': (), '_positions': positions})
+
+    def _sort_computed_fields(self) -> list:
+        """ Return the names of computed fields, each one after all the computed fields it depends on """
+        result = []
+        visited = set()
+
+        def visit(field_name, path):
+            if field_name in visited:
+                return
+            elif field_name in path:
+                raise InvalidValueException(_('Circular dependency between computed fields: %(f)s') %
+                                            {'f': ', '.join(path)})
+            field = self.fields[field_name]
+            for dependency in field.depends_on:
+                if dependency not in self.fields:
+                    raise InvalidValueException(_('Unknown field %(d)s used by %(f)s') %
+                                                {'d': dependency, 'f': field_name})
+                elif self.fields[dependency].computed:
+                    visit(dependency, path + [field_name])
+            visited.add(field_name)
+            result.append(field_name)
+
+        for name in self.field_order:
+            if self.fields[name].computed:
+                visit(name, [])
+        return result
+
+
 class FieldGroup(object):
+    """ Group of :class:`Field`, declared as class attributes.
+    Each Field is a data descriptor: reading or writing `group.field_name` reads or writes (after validation)
+    the value stored in `group._values`.
+    """
+    __slots__ = ()  # allow slotted subclasses, like CompactFieldGroup
+    schema_class = FieldGroupSchema
+    compact_storage = False  # store values in a CompactValues list instead of a dict
+    _fields = {}  # set for each class by _get_schema; shared by all instances: must not be modified
+    _field_order = []
+    _computed_fields = []
+    _dependents = {}
+    _track_changes = False  # call `_field_changed` for each modified field, not only for fields used by computed ones
 
     def __init__(self, initial=None, index=None):
         """
@@ -566,33 +1199,59 @@ class FieldGroup(object):
         """
         if initial is None:
             initial = {}
-        self._fields = {}
-        self._values = {}
-        fields = []
-        for cls in self.__class__.__mro__:
-            for field_name, field in cls.__dict__.items():
-                if not isinstance(field, Field) or field_name in self._fields:
-                    continue
-                self._fields[field_name] = field
-                field.name = field_name
-                value = initial.get(field_name, field.default)
-                self._values[field_name] = value
-                fields.append((field.group_field_order, field_name))
-        fields.sort()
-        self._field_order = [f[1] for f in fields]
+        schema = self._get_schema()
+        if schema.values_class is None:
+            self._values = {field_name: initial.get(field_name, field.default)
+                            for field_name, field in schema.fields.items()}
+        else:
+            fields = schema.fields
+            self._values = schema.values_class([initial.get(field_name, fields[field_name].default)
+                                                for field_name in schema.field_order])
+        for field_name in schema.computed_fields:
+            self._values[field_name] = _stale_value
         self.index = index
 
-    def __getattribute__(self, item: str):
-        if not item.startswith('_') and item in self._fields:
-            return self._values[item]
-        return super().__getattribute__(item)
-
-    def __setattr__(self, item: str, value):
-        if not item.startswith('_') and item in self._fields:
-            self._fields[item].is_valid(value)
-            self._values[item] = value
-            return
-        super().__setattr__(item, value)
+    @classmethod
+    def _get_schema(cls) -> FieldGroupSchema:
+        schema = cls.__dict__.get('_schema')
+        if schema is None:
+            schema = get_schema(cls, cls.schema_class)
+            cls._fields = schema.fields
+            cls._field_order = schema.field_order
+            cls._computed_fields = schema.computed_fields
+            cls._dependents = schema.dependents
+        return schema
+
+    def _field_changed(self, field_name: str) -> None:
+        """ Called when a field used by computed fields (or any field, with `_track_changes`) is modified """
+        for computed_field_name in self._dependents.get(field_name, ()):
+            self._values[computed_field_name] = _stale_value
+
+    def _compute_fields(self) -> None:
+        for field_name in self._computed_fields:
+            getattr(self, field_name)
+
+    def get_values(self) -> dict:
+        self._compute_fields()
+        return {field_name: self._values[field_name] for field_name in self._field_order}
+
+
+class CompactFieldGroup(FieldGroup):
+    """ Memory-efficient FieldGroup, for record-like groups held in large numbers.
+    Instances have no `__dict__` (subclasses must also define `__slots__ = ()`) and their values are stored in
+    a list indexed by field position. Field access is a bit slower than with the default storage.
+
+    >>> class Point(CompactFieldGroup):
+    ...     __slots__ = ()
+    ...     x = IntegerField(default=0)
+    ...     y = IntegerField(default=0)
+    >>> point = Point(initial={'x': 4})
+    >>> point.y = 2
+    >>> point.get_values() == {'x': 4, 'y': 2}
+    True
+    """
+    __slots__ = ('_values', 'index')
+    compact_storage = True
 
 
 if __name__ == '__main__':
@@ -1,13 +1,21 @@
 # coding=utf-8
+import collections
+import csv
+import functools
+import io
 import itertools
+import threading
+import time
 
 from PySide import QtGui, QtCore
 
 from qthelpers.exceptions import InvalidValueException
-from qthelpers.fields import FieldGroup, Field, ButtonField
-from qthelpers.shortcuts import create_button, h_layout, v_layout, warning
+from qthelpers.fields import FieldGroup, Field, ButtonField, FieldGroupSchema
+from qthelpers.models import FormsetModel, FormsetProxyModel, FieldDelegate
+from qthelpers.shortcuts import create_button, h_layout, v_layout, warning, get_icon
 from qthelpers.translation import ugettext as _
-from qthelpers.utils import p, ThreadedCalls
+from qthelpers.utils import p, ThreadedCalls, class_members, get_schema
+from qthelpers.widgets import SearchEdit
 
 
 __author__ = 'flanker'
@@ -25,25 +33,72 @@ class FormName(object):
         return self.verbose_name
 
 
+def _is_subform_class(name, value) -> bool:
+    return isinstance(value, type) and issubclass(value, SubForm)
+
+
+def _is_multiform_class(name, value) -> bool:
+    return isinstance(value, type) and (issubclass(value, MultiForm) or issubclass(value, SubForm))
+
+
+def _form_name_index(obj) -> int:
+    return getattr(obj.verbose_name, 'index', 0)
+
+
+class FormSchema(FieldGroupSchema):
+    """ Fields, MultiForm and SubForm classes of a :class:`BaseForm` subclass, in display order """
+
+    def __init__(self, cls: type):
+        super().__init__(cls)
+        self.multiforms = class_members(cls, _is_multiform_class)
+        """:type: list of (str, type)"""
+        # all components (MultiForm, SubForm and Field) in the right order, as a list of (is_multiform, name)
+        components = [(_form_name_index(subcls), True, name) for name, subcls in self.multiforms]
+        components += [(self.fields[name].group_field_order, False, name) for name in self.fields]
+        components.sort(key=lambda x: x[0])
+        self.components = [(is_multiform, name) for (order, is_multiform, name) in components]
+
+
+class MultiFormSchema(object):
+    """ SubForm classes of a :class:`MultiForm` subclass, sorted by their verbose_name """
+
+    def __init__(self, cls: type):
+        self.subforms = class_members(cls, _is_subform_class)
+        """:type: list of (str, type)"""
+        self.subforms.sort(key=lambda x: _form_name_index(x[1]))
+
+
 class BaseForm(FieldGroup):
+    schema_class = FormSchema
+    live_validation = True  # validate each field (and update its widget) while the user is editing it
+    live_validation_delay = 300  # in milliseconds: fields are validated when edition pauses for this delay
+
     def __init__(self, initial=None):
         FieldGroup.__init__(self, initial=initial)
         self._multiforms = {}
         """:type: dict of [str, MultiForm|SubForm]"""
         self._widgets = {}
-        # retrieve all MultiForm classes from class definitions
-        for cls in self.__class__.__mro__:
-            for name, subcls in cls.__dict__.items():
-                if not isinstance(subcls, type) or (not issubclass(subcls, MultiForm)
-                                                    and not issubclass(subcls, SubForm)) or name in self._multiforms:
-                    continue
-                self._multiforms[name] = subcls(initial=initial, parent=self)
+        self._touched_fields = set()
+        self._live_validation_timer = None
+        self._dirty_fields = set()  # fields whose widget has been modified since the last call to `is_valid`
+        self._untracked_fields = set()  # fields whose widget has no change signal: always considered as dirty
+        self._invalid_fields = {}  # {field name: error message} for the fields found invalid by `is_valid`
+        for name, subcls in self._get_schema().multiforms:
+            self._multiforms[name] = subcls(initial=initial, parent=self)
+        self._snapshot = {field.name: value for (field, value) in _iter_initial_values(self.__class__, initial or {})}
+
+    def _get_components(self) -> list:
+        """ Return all MultiForms and Fields, in the right order """
+        # noinspection PyProtectedMember
+        return [self._multiforms[name] if is_multiform else self._fields[name]
+                for (is_multiform, name) in self._get_schema().components]
 
     def set_values(self, initial: dict) -> None:
         for name, field in self._fields.items():
-            if name in initial:
+            if name in initial and not field.computed:
                 widget = self._widgets[name]
                 field.set_widget_value(widget, initial[name])
+                self._dirty_fields.add(name)
         for multiform in self._multiforms.values():
             if isinstance(multiform, SubForm):
                 multiform.set_values(initial)
@@ -55,12 +110,7 @@ class BaseForm(FieldGroup):
         :param layout:
         :return:
         """
-        all_components = []
-        for multiform in self._multiforms.values():
-            all_components.append(multiform)
-        for field in self._fields.values():
-            all_components.append(field)
-        all_components.sort(key=self._sort_components)
+        all_components = self._get_components()
         row_offset = layout.rowCount()
         for row_index, obj in enumerate(all_components):
             if isinstance(obj, MultiForm):  # a MultiForm already is a QWidget
@@ -74,7 +124,8 @@ class BaseForm(FieldGroup):
             else:
                 widget = obj.get_widget(self, self)
                 self._widgets[obj.name] = widget
-                obj.set_widget_value(widget, self._values[obj.name])
+                obj.set_widget_value(widget, getattr(self, obj.name))
+                self._connect_field_widget(obj, widget)
                 if obj.label:
                     label = QtGui.QLabel(obj.label, p(self))
                     label.setDisabled(obj.disabled)
@@ -86,12 +137,7 @@ class BaseForm(FieldGroup):
         :param layout:
         :return:
         """
-        all_components = []
-        for multiform in self._multiforms.values():
-            all_components.append(multiform)
-        for field in self._fields.values():
-            all_components.append(field)
-        all_components.sort(key=self._sort_components)
+        all_components = self._get_components()
         for row_index, obj in enumerate(all_components):
             if isinstance(obj, MultiForm):  # a MultiForm already is a QWidget
                 layout.addRow(obj)
@@ -104,21 +150,76 @@ class BaseForm(FieldGroup):
             else:
                 widget = obj.get_widget(self, self)
                 self._widgets[obj.name] = widget
-                obj.set_widget_value(widget, self._values[obj.name])
+                obj.set_widget_value(widget, getattr(self, obj.name))
+                self._connect_field_widget(obj, widget)
                 layout.addRow(obj.label or '', widget)
 
+    def _connect_field_widget(self, field: Field, widget) -> None:
+        if field.computed:  # read-only widget, updated by _field_changed
+            return
+        self._dirty_fields.add(field.name)
+        signal = field.get_change_signal(widget)
+        if signal is None:
+            self._untracked_fields.add(field.name)
+        else:
+            # noinspection PyUnresolvedReferences
+            signal.connect(functools.partial(self._field_touched, field.name))
+
+    def _field_touched(self, field_name: str, *args) -> None:
+        """ Called each time the widget of a field is modified: mark the field as dirty and restart the timer
+        validating all modified fields """
+        self._dirty_fields.add(field_name)
+        if not self.live_validation and self._fields[field_name].on_change is None and \
+                field_name not in self._dependents:
+            return
+        self._touched_fields.add(field_name)
+        if self._live_validation_timer is None:
+            self._live_validation_timer = QtCore.QTimer()
+            self._live_validation_timer.setSingleShot(True)
+            self._live_validation_timer.setInterval(self.live_validation_delay)
+            # noinspection PyUnresolvedReferences
+            self._live_validation_timer.timeout.connect(self._validate_touched_fields)
+        self._live_validation_timer.start()
+
+    def _validate_touched_fields(self) -> None:
+        """ Validate only the fields modified since the last call, and call their `on_change` callback """
+        touched_fields, self._touched_fields = self._touched_fields, set()
+        for field_name in touched_fields:
+            field = self._fields[field_name]
+            widget = self._widgets[field_name]
+            try:
+                value = field.get_widget_value(widget)
+            except ValueError as e:  # incomplete input, like "-" in an IntegerField
+                field.set_widget_valid(widget, False, str(e))
+                continue
+            if self.live_validation or field_name in self._dependents:
+                try:
+                    field.is_valid(value)
+                    field.set_widget_valid(widget, True, '')
+                    if field_name in self._dependents:  # update computed fields depending on this one
+                        self._values[field_name] = value
+                        self._field_changed(field_name)
+                except InvalidValueException as e:
+                    field.set_widget_valid(widget, False, str(e))
+            if field.on_change is not None:
+                field.on_change(self, widget, value)
+
     def is_valid(self):
-        valid = True
-        self._values = {}
-        for field_name, field in self._fields.items():
+        """ Read and validate the fields modified since the last call; values of other fields are kept.
+        Values of MultiForms are merged into the values of this form.
+        """
+        dirty_fields, self._dirty_fields = self._dirty_fields | self._untracked_fields, set()
+        for field_name in dirty_fields:
+            field = self._fields[field_name]
             widget = self._widgets[field_name]
             try:
                 setattr(self, field_name, field.get_widget_value(widget))
                 field.set_widget_valid(widget, True, '')
-                self._values[field_name] = field.get_widget_value(widget)
+                self._invalid_fields.pop(field_name, None)
             except InvalidValueException as e:
                 field.set_widget_valid(widget, False, str(e))
-                valid = False
+                self._invalid_fields[field_name] = str(e)
+        valid = not self._invalid_fields
         for multiform in self._multiforms.values():
             if multiform.is_valid():
                 self._values.update(multiform.get_values())
@@ -126,6 +227,38 @@ class BaseForm(FieldGroup):
                 valid = False
         return valid
 
+    def _field_changed(self, field_name: str) -> None:
+        FieldGroup._field_changed(self, field_name)
+        # computed fields are recomputed (in dependency order) only when they are displayed
+        for computed_field_name in self._dependents[field_name]:
+            widget = self._widgets.get(computed_field_name)
+            if widget is not None:
+                self._fields[computed_field_name].set_widget_value(widget, getattr(self, computed_field_name))
+
+    def reset(self, initial=None) -> None:
+        """ Set all fields (including the ones of MultiForms) to their initial values, like a new form """
+        values = {field.name: value for (field, value) in _iter_initial_values(self.__class__, initial or {})}
+        self.set_values(values)
+        for field_name in self._invalid_fields:
+            widget = self._widgets.get(field_name)
+            if widget is not None:  # a VirtualForm only has widgets for visible rows
+                self._fields[field_name].set_widget_valid(widget, True, '')
+        self._invalid_fields = {}
+        self._snapshot = values
+
+    def snapshot(self) -> None:
+        """ Use the current values (as read by the last call to `is_valid`) as reference for `get_changed_values`.
+        The initial values of the form are the first reference. Computed fields are ignored.
+        """
+        values = self._values
+        self._snapshot = {name: values.get(name, value) for (name, value) in self._snapshot.items()}
+
+    def get_changed_values(self) -> dict:
+        """ Return only the values that differ from the last snapshot (call `is_valid` first), except computed ones """
+        values = self._values
+        return {name: values[name] for (name, value) in self._snapshot.items()
+                if name in values and values[name] != value}
+
     def get_widget(self, field_name):  # TODO rechercher dans les multiforms
         return self._widgets[field_name]
 
@@ -136,14 +269,9 @@ class BaseForm(FieldGroup):
         return self._multiforms[multiform_name]
 
     def get_values(self):
+        self._compute_fields()
         return self._values
 
-    @staticmethod
-    def _sort_components(obj) -> int:
-        if isinstance(obj, MultiForm) or isinstance(obj, SubForm):
-            return getattr(obj.verbose_name, 'index', 0)
-        return obj.group_field_order
-
 
 class Form(BaseForm, QtGui.QWidget):
     def __init__(self, initial=None, parent=None):
@@ -159,6 +287,148 @@ class SubForm(Form):
     enabled = True
 
 
+class VirtualForm(BaseForm, QtGui.QScrollArea):
+    """ Scrolling form for a very large number of fields, like generated parameter lists.
+    Only the rows intersecting the viewport, plus `overscan` rows above and below, have a label and an editor.
+    Values of other rows stay in the value store and are validated without creating any widget.
+    All rows have the same height. MultiForms and SubForms are not supported.
+    """
+    row_height = 30  # in pixels
+    overscan = 10  # number of rows realised above and below the visible ones
+    label_width = 200  # in pixels
+
+    def __init__(self, initial=None, parent=None):
+        if self._get_schema().multiforms:
+            raise InvalidValueException(_('%(c)s cannot contain MultiForms or SubForms') %
+                                        {'c': self.__class__.__name__})
+        BaseForm.__init__(self, initial=initial)
+        QtGui.QScrollArea.__init__(self, p(parent))
+        self._row_fields = [name for (is_multiform, name) in self._get_schema().components]
+        self._realised_rows = {}  # {row index: (label or None, widget)}
+        self._pinned_rows = set()  # rows kept realised because their widget holds an unreadable or invalid value
+        self._container = QtGui.QWidget(p(self))
+        self._container.setMinimumHeight(len(self._row_fields) * self.row_height)
+        self.setWidget(self._container)
+        self.setWidgetResizable(True)
+        # noinspection PyUnresolvedReferences
+        self.verticalScrollBar().valueChanged.connect(self._update_rows)
+        self._update_rows()
+
+    def _update_rows(self, *args) -> None:
+        """ Realise the rows that are (nearly) visible and release the other ones """
+        first_visible = self.verticalScrollBar().value() // self.row_height
+        visible_count = self.viewport().height() // self.row_height + 1
+        first_row = max(0, first_visible - self.overscan)
+        last_row = min(len(self._row_fields), first_visible + visible_count + self.overscan)
+        for row in [row for row in self._realised_rows if not first_row <= row < last_row]:
+            self._release_row(row)
+        for row in range(first_row, last_row):
+            if row not in self._realised_rows:
+                self._realise_row(row)
+
+    def _place_row(self, row: int, label, widget) -> None:
+        top = row * self.row_height
+        if label is not None:
+            label.setGeometry(0, top, self.label_width, self.row_height)
+        widget.setGeometry(self.label_width, top, max(0, self.viewport().width() - self.label_width), self.row_height)
+
+    def _realise_row(self, row: int) -> None:
+        field = self._fields[self._row_fields[row]]
+        label = None
+        if field.label:
+            label = QtGui.QLabel(field.label, p(self._container))
+            label.setDisabled(field.disabled)
+            label.show()
+        widget = field.get_widget(self, self._container)
+        self._widgets[field.name] = widget
+        field.set_widget_value(widget, getattr(self, field.name))
+        if field.name in self._invalid_fields:
+            field.set_widget_valid(widget, False, self._invalid_fields[field.name])
+        self._connect_field_widget(field, widget)
+        self._dirty_fields.discard(field.name)  # the widget displays the stored value
+        self._place_row(row, label, widget)
+        widget.show()
+        self._realised_rows[row] = (label, widget)
+
+    def _release_row(self, row: int) -> None:
+        """ Store the value of a realised row and delete its widgets, unless this value cannot be stored """
+        field_name = self._row_fields[row]
+        if field_name in self._dirty_fields or field_name in self._untracked_fields or row in self._pinned_rows:
+            if not self._store_widget_value(field_name):
+                self._pinned_rows.add(row)
+                return
+        self._pinned_rows.discard(row)
+        self._dirty_fields.discard(field_name)
+        self._untracked_fields.discard(field_name)
+        self._touched_fields.discard(field_name)
+        del self._widgets[field_name]
+        for widget in self._realised_rows.pop(row):
+            if widget is not None:
+                widget.hide()
+                widget.deleteLater()
+
+    def _store_widget_value(self, field_name: str) -> bool:
+        """ Read the widget of a realised row and store its value; return False if this value is invalid """
+        field = self._fields[field_name]
+        widget = self._widgets[field_name]
+        try:
+            setattr(self, field_name, field.get_widget_value(widget))
+        except (ValueError, InvalidValueException) as e:
+            field.set_widget_valid(widget, False, str(e))
+            self._invalid_fields[field_name] = str(e)
+            return False
+        field.set_widget_valid(widget, True, '')
+        self._invalid_fields.pop(field_name, None)
+        return True
+
+    def resizeEvent(self, event):
+        QtGui.QScrollArea.resizeEvent(self, event)
+        for row, (label, widget) in self._realised_rows.items():
+            self._place_row(row, label, widget)
+        self._update_rows()
+
+    def show_field(self, field_name: str) -> QtGui.QWidget:
+        """ Scroll to a field (for example, an invalid one) and return its widget """
+        row = self._row_fields.index(field_name)
+        self.ensureVisible(0, row * self.row_height + self.row_height // 2, 0, self.row_height)
+        self._update_rows()
+        return self._widgets[field_name]
+
+    def set_values(self, initial: dict) -> None:
+        for name, field in self._fields.items():
+            if name not in initial or field.computed:
+                continue
+            widget = self._widgets.get(name)
+            if widget is None:  # validated by the next call to `is_valid`
+                self._values[name] = initial[name]
+                if name in self._dependents:
+                    self._field_changed(name)
+            else:
+                field.set_widget_value(widget, initial[name])
+                self._dirty_fields.add(name)
+
+    def is_valid(self):
+        """ Read the modified widgets of realised rows, then directly validate the stored values of other rows """
+        dirty_fields, self._dirty_fields = self._dirty_fields | self._untracked_fields, set()
+        dirty_fields |= {self._row_fields[row] for row in self._pinned_rows}
+        for field_name in dirty_fields:
+            self._store_widget_value(field_name)
+        for field_name, field in self._fields.items():
+            if field_name in dirty_fields or field.computed:
+                continue
+            widget = self._widgets.get(field_name)
+            try:
+                field.is_valid(self._values[field_name])
+            except InvalidValueException as e:
+                self._invalid_fields[field_name] = str(e)
+                if widget is not None:
+                    field.set_widget_valid(widget, False, str(e))
+                continue
+            if self._invalid_fields.pop(field_name, None) is not None and widget is not None:
+                field.set_widget_valid(widget, True, '')
+        return not self._invalid_fields
+
+
 # class MyDialog(GenericForm):
 # field_1 = CharField()
 #     class tabs(MultiForm):
@@ -167,8 +437,86 @@ class SubForm(Form):
 #             field_str_1 = CharField()
 
 
+def _iter_initial_values(form_class: type, initial: dict):
+    """ Iterate over all (field, value) of a form that has never been created, including its MultiForms and SubForms.
+    Computed fields are left out: they are only computed when they are read from a created form.
+    :param form_class: subclass of BaseForm
+    :param initial: initial values
+    """
+    # noinspection PyProtectedMember
+    schema = form_class._get_schema()
+    for field_name, field in schema.fields.items():
+        if not field.computed:
+            yield field, initial.get(field_name, field.default)
+    for name, subcls in schema.multiforms:
+        if issubclass(subcls, SubForm):
+            yield from _iter_initial_values(subcls, initial)
+            continue
+        for subform_name, subform_class in get_schema(subcls, MultiFormSchema).subforms:
+            yield from _iter_initial_values(subform_class, initial)
+
+
+class SubFormPage(QtGui.QWidget):
+    """ Page of a MultiForm, holding a SubForm. The SubForm (and all its widgets) is only created when the page is
+    displayed for the first time, or when it is explicitly required. Until then, its values are the initial ones.
+    Unknown attributes are looked up in the SubForm.
+    """
+
+    def __init__(self, subform_class: type, initial: dict, parent=None):
+        QtGui.QWidget.__init__(self, p(parent))
+        self.subform_class = subform_class
+        self.verbose_name = subform_class.verbose_name
+        self.enabled = subform_class.enabled
+        self.initial = initial
+        self.subform = None
+        """:type: SubForm"""
+        layout = QtGui.QVBoxLayout(None)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+
+    def materialize(self) -> SubForm:
+        """ Create the SubForm if it does not exist yet, and return it """
+        if self.subform is None:
+            self.subform = self.subform_class(initial=self.initial, parent=self)
+            self.layout().addWidget(self.subform)
+            self.subform.show()
+        return self.subform
+
+    def showEvent(self, event):
+        self.materialize()
+        QtGui.QWidget.showEvent(self, event)
+
+    def __getattr__(self, item: str):
+        if item.startswith('_') or item == 'subform':
+            raise AttributeError(item)
+        return getattr(self.materialize(), item)
+
+    def set_values(self, initial: dict) -> None:
+        if self.subform is not None:
+            self.subform.set_values(initial)
+        else:
+            self.initial.update(initial)
+
+    def is_valid(self) -> bool:
+        if self.subform is not None:
+            return self.subform.is_valid()
+        try:
+            for field, value in _iter_initial_values(self.subform_class, self.initial):
+                field.is_valid(value)
+        except InvalidValueException:
+            return False
+        return True
+
+    def get_values(self) -> dict:
+        """ Values of the SubForm, or its initial values (without computed fields) if it has not been created """
+        if self.subform is not None:
+            return self.subform.get_values()
+        return {field.name: value for (field, value) in _iter_initial_values(self.subform_class, self.initial)}
+
+
 class MultiForm(object):
     verbose_name = None  # FormName('')
+    lazy_subforms = True  # only create the widgets of a SubForm when it is displayed for the first time
 
     def __init__(self, initial=None):
         """
@@ -176,34 +524,33 @@ class MultiForm(object):
         :return:
         """
         self._subforms_by_name = {}
+        """:type: dict of [str, SubFormPage]"""
         self._subforms_list = []
         self._values = {}
-        for cls in self.__class__.__mro__:
-            for subform_name, subform_class in cls.__dict__.items():
-                if isinstance(subform_class, type) and issubclass(subform_class, SubForm) \
-                        and subform_name not in self._subforms_by_name:
-                    subform = subform_class(initial=initial)
-                    """:type: SubForm"""
-                    self._subforms_by_name[subform_name] = subform
-                    self._subforms_list.append((subform_name, subform))
-        self._subforms_list.sort(key=lambda x: getattr(x[1].verbose_name, 'index', 0))
-        for subform_index, (subform_name, subform) in enumerate(self._subforms_list):
-            self.add_form(subform_index, subform_name, subform)
-            self.set_form_enabled(subform_index, subform, bool(subform.enabled))
+        initial = {} if initial is None else dict(initial)
+        for subform_name, subform_class in get_schema(self.__class__, MultiFormSchema).subforms:
+            page = SubFormPage(subform_class, initial, parent=self)
+            if not self.lazy_subforms:
+                page.materialize()
+            self._subforms_by_name[subform_name] = page
+            self._subforms_list.append((subform_name, page))
+            setattr(self, subform_name, page)
+        for subform_index, (subform_name, page) in enumerate(self._subforms_list):
+            self.add_form(subform_index, subform_name, page)
+            self.set_form_enabled(subform_index, subform_name, bool(page.enabled))
 
     def set_values(self, initial: dict) -> None:
-        for subform in self._subforms_list:
-            subform.set_values(initial)
+        for subform_name, page in self._subforms_list:
+            page.set_values(initial)
 
-    def __getattribute__(self, item: str):
-        if not item.startswith('_') and item in self._subforms_by_name:
-            return self._subforms_by_name[item]
-        return super().__getattribute__(item)
+    def get_subform(self, name: str) -> SubForm:
+        """ Return the SubForm `name`, creating its widgets if required """
+        return self._subforms_by_name[name].materialize()
 
-    def set_current(self, index: int, name: str, subform: SubForm):
+    def set_current(self, index: int, name: str, subform: SubFormPage):
         raise NotImplementedError
 
-    def add_form(self, index: int, name: str, subform: SubForm):
+    def add_form(self, index: int, name: str, subform: SubFormPage):
         raise NotImplementedError
 
     def set_form_enabled(self, index, name, enabled):
@@ -213,12 +560,13 @@ class MultiForm(object):
         valid = True
         self._values = {}
         for subform_index, subform_data in enumerate(self._subforms_list):
-            subform_name, subform = subform_data
-            """:type: (int, FormTab)"""
-            if subform.is_valid():
-                self._values.update(subform.get_values())
+            subform_name, page = subform_data
+            """:type: (str, SubFormPage)"""
+            if page.is_valid():
+                self._values.update(page.get_values())
             elif valid:
-                self.set_current(subform_index, str(subform.verbose_name), subform)
+                self.set_current(subform_index, str(page.verbose_name), page)
+                page.materialize().is_valid()  # highlight invalid fields
                 valid = False
             else:
                 valid = False
@@ -228,11 +576,23 @@ class MultiForm(object):
         return self._values
 
 
+_dialog_pool = {}  # {FormDialog subclass: hidden instance}
+
+
+def _forget_pooled_dialog(cls: type, dialog_id: int, *args) -> None:
+    """ Remove a destroyed dialog (for example, destroyed with its parent) from the pool """
+    dialog = _dialog_pool.get(cls)
+    if dialog is not None and id(dialog) == dialog_id:
+        del _dialog_pool[cls]
+
+
 class FormDialog(BaseForm, QtGui.QDialog, ThreadedCalls):
     verbose_name = None
     description = None
     text_confirm = _('Yes')
     text_cancel = _('Cancel')
+    reuse_instance = False  # if True, `process` reuses a hidden instance, reset with the new initial values. Only
+    # set it when the widgets of the dialog do not depend on its initial values.
 
     def __init__(self, initial=None, parent=None):
         QtGui.QDialog.__init__(self, p(parent))
@@ -257,12 +617,42 @@ class FormDialog(BaseForm, QtGui.QDialog, ThreadedCalls):
             self.setWindowTitle(str(self.verbose_name))
         self.raise_()
 
+    @classmethod
+    def get_instance(cls, initial=None, parent=None) -> 'FormDialog':
+        """ Return the pooled instance of this dialog (created on the first call), reset with `initial` values.
+        A new instance is returned if the pooled one is already displayed.
+        """
+        dialog = _dialog_pool.get(cls)
+        if dialog is None:
+            dialog = cls(initial=initial, parent=parent)
+            _dialog_pool[cls] = dialog
+            # noinspection PyUnresolvedReferences
+            dialog.destroyed.connect(functools.partial(_forget_pooled_dialog, cls, id(dialog)))
+            return dialog
+        elif dialog.isVisible():
+            return cls(initial=initial, parent=parent)
+        parent = p(parent)
+        if parent is not None and dialog.parentWidget() is not parent:
+            dialog.setParent(parent, dialog.windowFlags())
+        dialog.reset(initial)
+        return dialog
+
+    @classmethod
+    def release_instance(cls) -> None:
+        """ Remove the pooled instance of this dialog (if any) from the pool, and delete it if it is not displayed """
+        dialog = _dialog_pool.pop(cls, None)
+        if dialog is not None and not dialog.isVisible():
+            dialog.deleteLater()
+
     @classmethod
     def process(cls, initial=None, parent=None):
-        dialog = cls(initial=initial, parent=parent)
+        if cls.reuse_instance:
+            dialog = cls.get_instance(initial=initial, parent=parent)
+        else:
+            dialog = cls(initial=initial, parent=parent)
         result = dialog.exec_()
         if result == QtGui.QDialog.Accepted:
-            return dialog.get_values()
+            return dict(dialog.get_values())  # the values of a reused instance are modified by its next use
         return None
 
     def accept(self):
@@ -276,10 +666,10 @@ class TabbedMultiForm(MultiForm, QtGui.QTabWidget):
         QtGui.QTabWidget.__init__(self, p(parent))
         MultiForm.__init__(self, initial=initial)
 
-    def set_current(self, index: int, name: str, subform: SubForm):
+    def set_current(self, index: int, name: str, subform: SubFormPage):
         self.setCurrentIndex(index)
 
-    def add_form(self, index: int, name: str, subform: SubForm):
+    def add_form(self, index: int, name: str, subform: SubFormPage):
         self.addTab(subform, str(subform.verbose_name))
 
     def set_form_enabled(self, index, name, enabled):
@@ -297,11 +687,11 @@ class StackedMultiForm(MultiForm, QtGui.QGroupBox):
         self.setTitle(str(self.verbose_name))
         self.setLayout(v_layout(self, self._stacked_names, self._stacked_widget))
 
-    def set_current(self, index: int, name: str, subform: SubForm):
+    def set_current(self, index: int, name: str, subform: SubFormPage):
         self._stacked_widget.setCurrentIndex(index)
         self._stacked_names.setCurrentIndex(index)
 
-    def add_form(self, index: int, name: str, subform: SubForm):
+    def add_form(self, index: int, name: str, subform: SubFormPage):
         self._stacked_widget.addWidget(subform)
         self._stacked_names.addItem(str(subform.verbose_name))
 
@@ -317,18 +707,19 @@ class ToolboxMultiForm(MultiForm, QtGui.QToolBox):
         QtGui.QToolBox.__init__(self, p(parent))
         MultiForm.__init__(self, initial=initial)
 
-    def set_current(self, index: int, name: str, subform: SubForm):
+    def set_current(self, index: int, name: str, subform: SubFormPage):
         self.setCurrentIndex(index)
 
-    def add_form(self, index: int, name: str, subform: SubForm):
+    def add_form(self, index: int, name: str, subform: SubFormPage):
         self.addItem(subform, str(subform.verbose_name))
 
     def set_form_enabled(self, index, name, enabled):
         self.setItemEnabled(index, enabled)
 
 
-class Formset(QtGui.QTreeWidget):
-    """
+class BaseFormset(object):
+    """ Common part of :class:`Formset` and :class:`ModelFormset`: a list of items, each item displaying all fields
+    defined on the class.
     """
     min_number = None
     max_number = None
@@ -337,37 +728,381 @@ class Formset(QtGui.QTreeWidget):
     show_remove_button = False
     add_help_text = ''
     remove_help_text = ''
+    # rows fed from an iterable (see `feed`)
+    feed_progress = QtCore.Signal(int)  # number of rows inserted since the beginning of the feed
+    feed_finished = QtCore.Signal(bool)  # False if the feed has been cancelled, or if `rows` raised an exception
+    feed_chunk_size = 100  # rows are inserted by chunks of this size…
+    feed_time_slice = 20  # … during at most this time (in milliseconds) before giving control back to the event loop
+    feed_batch_size = 1000  # when rows are produced in a secondary thread, they are sent by batches of this size
+    _feed_id = 0
+    _feeding = False
+    _feed_timer = None
+    _feed_iterator = None
+    _feed_queue = None
+    _feed_producing = False
+    _feed_count = 0
+    # validation (see `is_valid`)
+    validation_finished = QtCore.Signal(bool)  # emitted by `validate_in_background`, with the validation result
+    validation_thread_threshold = 5000  # `validate_in_background` uses a secondary thread above this number of items
+    _pending_validation = None  # {id(key): (key, values)} for items being validated in a secondary thread
+
+    def item_count(self) -> int:
+        raise NotImplementedError
 
-    def __init__(self, initial: list=None, parent=None):
+    def extend(self, rows: list):
+        raise NotImplementedError
+
+    def get_errors(self) -> dict:
+        """ Return the errors found by the last validation, as a dict {(item index, column): error message} """
+        raise NotImplementedError
+
+    def iter_values(self):
+        """ Iterate over the values of all items (dictionnaries {field_name: field_value}) """
+        raise NotImplementedError
+
+    def _get_copied_values(self):
+        """ Values copied to the clipboard: all items by default """
+        return self.iter_values()
+
+    def _get_csv_field_names(self) -> list:
+        return get_schema(self.__class__, FieldGroupSchema).field_order
+
+    def _write_csv(self, csv_file, dialect, header: bool, values) -> None:
+        field_names = self._get_csv_field_names()
+        fields = [self._fields[field_name] for field_name in field_names]
+        writer = csv.writer(csv_file, dialect=dialect)
+        if header:
+            writer.writerow(field_names)
+        # rows are converted and written one at a time
+        writer.writerows([field.to_text(row[field.name]) for field in fields] for row in values)
+
+    def _read_csv(self, reader, columns: list, first_line: int=1) -> list:
+        """ Convert CSV rows to values, raising InvalidValueException on the first invalid cell (values that cannot
+        be converted, or rejected by the validators of their field)
+        :param reader: csv.reader
+        :param columns: field name of each column (unknown names are ignored)
         """
-        :param initial: initial values, as a dictionnary {field_name: field_value}
+        field_names = set(self._get_csv_field_names())
+        fields = [self._fields[name] if name in field_names else None for name in columns]
+        rows = []
+        for line_number, line in enumerate(reader, start=first_line):
+            values = {}
+            for field, text in zip(fields, line):
+                if field is None:
+                    continue
+                try:
+                    values[field.name] = field.from_text(text)
+                except ValueError:
+                    raise InvalidValueException(_('Invalid value “%(v)s” (line %(l)d, column “%(c)s”)') %
+                                                {'v': text, 'l': line_number, 'c': field.name})
+            rows.append(values)
+        # missing values are replaced by default values, as in `extend`
+        complete_rows = [{field_name: values.get(field_name, self._fields[field_name].default)
+                          for field_name in self._field_order} for values in rows]
+        errors = self._validate_rows(complete_rows)
+        if errors:
+            position, column = min(errors)
+            raise InvalidValueException(_('Invalid value (line %(l)d, column “%(c)s”): %(m)s') %
+                                        {'l': position + first_line, 'c': self._field_order[column],
+                                         'm': errors[(position, column)]})
+        return rows
+
+    def export_csv(self, csv_file, dialect='excel', header: bool=True) -> None:
+        """ Write all items to a CSV file, one row at a time (values are converted by `Field.to_text`)
+        :param csv_file: filename, or text file opened with newline=''
+        :param dialect: CSV dialect ('excel', 'excel-tab', …)
+        :param header: write field names on the first line
+        """
+        if isinstance(csv_file, str):
+            with open(csv_file, 'w', encoding='utf-8', newline='') as fd:
+                self._write_csv(fd, dialect, header, self.iter_values())
+        else:
+            self._write_csv(csv_file, dialect, header, self.iter_values())
+
+    def import_csv(self, csv_file, dialect='excel', header: bool=True) -> int:
+        """ Append items read from a CSV file (values are converted by `Field.from_text`).
+        The whole file is converted and validated before the insertion, so no item is added when a value is invalid.
+        :param csv_file: filename, or text file opened with newline=''
+        :param dialect: CSV dialect ('excel', 'excel-tab', …)
+        :param header: the first line gives the field name of each column; otherwise, columns are in the field order
+        :return: number of read items
+        """
+        if isinstance(csv_file, str):
+            with open(csv_file, 'r', encoding='utf-8', newline='') as fd:
+                return self.import_csv(fd, dialect=dialect, header=header)
+        reader = csv.reader(csv_file, dialect=dialect)
+        if header:
+            rows = self._read_csv(reader, next(reader, []), first_line=2)
+        else:
+            rows = self._read_csv(reader, self._get_csv_field_names())
+        self.extend(rows)
+        return len(rows)
+
+    def copy_to_clipboard(self) -> None:
+        """ Copy items as tab-separated values (with field names on the first line), to be pasted in a spreadsheet """
+        text = io.StringIO()
+        self._write_csv(text, 'excel-tab', True, self._get_copied_values())
+        QtGui.QApplication.clipboard().setText(text.getvalue())
+
+    def paste_from_clipboard(self) -> int:
+        """ Append items from tab-separated values in the clipboard (like a range copied from a spreadsheet).
+        If the first line only contains field names, it gives the field of each column.
+        :return: number of pasted items
+        """
+        reader = csv.reader(io.StringIO(QtGui.QApplication.clipboard().text()), dialect='excel-tab')
+        first_line = next(reader, None)
+        if not first_line:
+            return 0
+        field_names = self._get_csv_field_names()
+        if set(first_line) <= set(field_names):
+            rows = self._read_csv(reader, first_line, first_line=2)
+        else:
+            rows = self._read_csv(itertools.chain([first_line], reader), field_names)
+        self.extend(rows)
+        return len(rows)
+
+    def _take_modified_items(self) -> (list, list):
+        """ Return the items modified since the last call, as a list of keys identifying them and the list of their
+        values (dictionnaries {field_name: field_value}) """
+        raise NotImplementedError
+
+    def _set_errors(self, keys: list, errors: dict) -> None:
+        """ Store (and display) the result of a validation
+        :param keys: keys of the validated items, as returned by `_take_modified_items`
+        :param errors: {(position in `keys`, column): error message}
+        """
+        raise NotImplementedError
+
+    def _validate_rows(self, rows: list) -> dict:
+        """ Validate values column by column (can be called from a secondary thread)
+        :param rows: list of dictionnaries {field_name: field_value}
+        :return: {(position in `rows`, column): error message}
+        """
+        errors = {}
+        for column, field_name in enumerate(self._field_order):
+            field = self._fields[field_name]
+            for position, msg in field.validate_many([values[field_name] for values in rows]).items():
+                errors[(position, column)] = msg
+        return errors
+
+    def is_valid(self) -> bool:
+        """ Validate items modified since the last validation (previous results are kept for the other ones) """
+        keys, rows = self._take_modified_items()
+        if keys:
+            self._set_errors(keys, self._validate_rows(rows))
+        return not self.get_errors()
+
+    def validate_in_background(self) -> None:
+        """ Same as `is_valid`, but large sets of items are validated in a secondary thread.
+        `validation_finished` is emitted with the result.
+        """
+        keys, rows = self._take_modified_items()
+        if not self._pending_validation and len(keys) < self.validation_thread_threshold:
+            if keys:
+                self._set_errors(keys, self._validate_rows(rows))
+            # noinspection PyUnresolvedReferences
+            self.validation_finished.emit(not self.get_errors())
+            return
+        # the result of a running validation is cancelled, so its items must be validated again
+        pending_validation = dict(self._pending_validation or {})
+        pending_validation.update({id(key): (key, values) for (key, values) in zip(keys, rows)})
+        self._pending_validation = pending_validation
+        keys = [key for (key, values) in pending_validation.values()]
+        rows = [values for (key, values) in pending_validation.values()]
+        # noinspection PyUnresolvedReferences
+        self.cancellable_call(self._validate_rows_keys, self._background_validation_done, rows, keys)
+
+    def _validate_rows_keys(self, rows: list, keys: list) -> dict:
+        """ Secondary thread of `validate_in_background`: same arguments as `_background_validation_done`.
+        Unexpected exceptions are returned, to be raised in the GUI thread.
+        """
+        try:
+            return self._validate_rows(rows)
+        except Exception as e:
+            return e
+
+    def _background_validation_done(self, errors: dict or Exception, rows: list, keys: list) -> None:
+        self._pending_validation = None
+        if isinstance(errors, Exception):
+            raise errors
+        self._set_errors(keys, errors)
+        # noinspection PyUnresolvedReferences
+        self.validation_finished.emit(not self.get_errors())
+
+    def feed(self, rows, threaded: bool=False) -> None:
+        """ Append all rows produced by an iterable (like a generator reading a large file, or a database cursor).
+        Rows are inserted by chunks from the event loop, so the GUI stays responsive. `feed_progress` is emitted after
+        each time slice, and `feed_finished` at the end. Rows beyond `max_number` are ignored.
+        A running feed is cancelled first. If iterating over `rows` raises an exception, the feed is stopped (keeping
+        already inserted rows) and the exception is raised again in the GUI thread.
+        :param rows: iterable of dictionnaries {field_name: field_value}
+        :param threaded: iterate over `rows` in a secondary thread, sending rows to the GUI thread by batches
+        """
+        self.cancel_feed()
+        self._feed_id += 1
+        self._feeding = True
+        self._feed_count = 0
+        self._feed_queue = collections.deque()
+        self._feed_producing = threaded
+        if threaded:
+            self._feed_iterator = None
+            thread = threading.Thread(target=self._feed_producer, args=(self._feed_id, iter(rows)))
+            thread.daemon = True
+            thread.start()
+        else:
+            self._feed_iterator = iter(rows)
+        if self._feed_timer is None:
+            self._feed_timer = QtCore.QTimer()
+            self._feed_timer.setInterval(0)
+            # noinspection PyUnresolvedReferences
+            self._feed_timer.timeout.connect(self._feed_step)
+        self._feed_timer.start()
+
+    def cancel_feed(self) -> None:
+        """ Stop the current feed, keeping already inserted rows """
+        if self._feeding:
+            self._feed_id += 1
+            self._end_feed(False)
+
+    def is_feeding(self) -> bool:
+        return self._feeding
+
+    def _feed_producer(self, feed_id: int, iterator):
+        """ Secondary thread: read rows and send them by batches to the GUI thread.
+        An exception raised by `iterator` is sent to the GUI thread, with the end of the feed.
+        """
+        error = None
+        try:
+            while feed_id == self._feed_id:
+                batch = list(itertools.islice(iterator, self.feed_batch_size))
+                if not batch:
+                    break
+                # noinspection PyUnresolvedReferences
+                self.signal_call(self._feed_received, feed_id, batch)
+        except Exception as e:
+            error = e
+        finally:
+            # noinspection PyUnresolvedReferences
+            self.signal_call(self._feed_received, feed_id, None, error)
+
+    def _feed_received(self, feed_id: int, batch: list or None, error: Exception=None):
+        if feed_id != self._feed_id:  # cancelled feed
+            return
+        if error is not None:
+            self._feed_id += 1
+            self._end_feed(False)
+            raise error
+        if batch is None:
+            self._feed_producing = False
+        else:
+            self._feed_queue.extend(batch)
+        if not self._feed_timer.isActive():
+            self._feed_timer.start()
+
+    def _feed_step(self):
+        deadline = time.perf_counter() + self.feed_time_slice / 1000.
+        chunk_size = self.feed_chunk_size
+        finished = False
+        while time.perf_counter() < deadline:
+            if self._feed_iterator is not None:
+                try:
+                    chunk = list(itertools.islice(self._feed_iterator, chunk_size))
+                except Exception:
+                    self._feed_id += 1
+                    self._end_feed(False)
+                    raise
+                finished = len(chunk) < chunk_size
+            else:
+                queue = self._feed_queue
+                chunk = [queue.popleft() for i in range(min(chunk_size, len(queue)))]
+                finished = not self._feed_producing and not queue
+            if self.max_number is not None:
+                remaining = self.max_number - self.item_count()
+                if len(chunk) >= remaining:
+                    chunk, finished = chunk[:max(remaining, 0)], True
+            if chunk:
+                self.extend(chunk)
+                self._feed_count += len(chunk)
+            if finished:
+                break
+            elif not chunk:  # waiting for the next batch of the producer thread
+                self._feed_timer.stop()
+                break
+        # noinspection PyUnresolvedReferences
+        self.feed_progress.emit(self._feed_count)
+        if finished:
+            self._feed_id += 1  # stop the producer thread, if any
+            self._end_feed(True)
+
+    def _end_feed(self, complete: bool):
+        self._feed_timer.stop()
+        self._feeding = False
+        self._feed_iterator = None
+        self._feed_queue = None
+        self._feed_producing = False
+        # noinspection PyUnresolvedReferences
+        self.feed_finished.emit(complete)
+
+    def _get_initial_values(self, initial: list) -> list:
+        """ Return the list of initial values, with respect to `min_number` and `max_number`
+        :param initial: list of dictionnaries {field_name: field_value}
         """
-        QtGui.QTreeWidget.__init__(self, p(parent))
         if initial is None:
             initial = []
-        self._fields = {}
         item_count = len(initial)
         if self.min_number is not None:
             item_count = max(self.min_number, item_count)
         if self.max_number is not None:
             item_count = min(self.max_number, item_count)
-        # noinspection PyUnusedLocal
-        self._values = [{} for i in range(item_count)]
-        fields = []
-        for cls in self.__class__.__mro__:
-            for field_name, field in cls.__dict__.items():
-                if not isinstance(field, Field) or field_name in self._fields:
-                    continue
-                self._fields[field_name] = field
-                field.name = field_name
-                for index in range(item_count):  # get initial values
-                    if index < len(initial):
-                        self._values[index][field_name] = initial[index].get(field_name, field.default)
-                    else:
-                        self._values[index][field_name] = field.default
-                fields.append((field.group_field_order, field_name))
-        fields.sort()
-        self._field_order = [f[1] for f in fields]
+        schema = get_schema(self.__class__, FieldGroupSchema)
+        values = []
+        for index in range(item_count):
+            item_initial = initial[index] if index < len(initial) else {}
+            values.append({field_name: item_initial.get(field_name, field.default)
+                           for (field_name, field) in schema.fields.items()})
+        return values
+
+    def _can_add_items(self, item_count: int, added_count: int=1) -> bool:
+        if self.max_number is not None and item_count + added_count > self.max_number:
+            warning(_('Unable to add item'), _('Unable to add more than %(s)d items.') % {'s': self.max_number},
+                    only_ok=True)
+            return False
+        return True
+
+    def _can_remove_items(self, item_count: int, removed_count: int=1) -> bool:
+        if self.min_number is not None and item_count - removed_count < self.min_number:
+            warning(_('Unable to remove item'), _('At least %(s)d items are required.') % {'s': self.min_number},
+                    only_ok=True)
+            return False
+        return True
+
+
+class Formset(BaseFormset, QtGui.QTreeWidget, ThreadedCalls):
+    """ Formset displaying one widget per field and per item.
+    Prefer :class:`ModelFormset` for more than a few hundreds items.
+    With `recycle_widgets`, removed items are kept in a pool with their widgets and reused for new items, instead of
+    being deleted and created again. `get_widget_counters` allows to check the pool efficiency.
+    """
+    recycle_widgets = False
+    item_pool_size = 50  # maximum number of removed items kept with their widgets
+
+    def __init__(self, initial: list=None, parent=None):
+        """
+        :param initial: initial values, as a list of dictionnaries {field_name: field_value}
+        """
+        QtGui.QTreeWidget.__init__(self, p(parent))
+        ThreadedCalls.__init__(self)
+        self._modified_items = set()
+        self._item_errors = {}  # {item: {column: error message}}
+        self._read_errors = {}  # {item: {column: error message}} for widgets with unreadable values
+        self._widget_items = {}  # {widget: item}
+        self._item_widgets = {}  # {item: list of widgets} (only with `recycle_widgets`)
+        self._item_pool = []  # list of (removed item, list of widgets)
+        self._widget_counters = {'created': 0, 'reused': 0, 'released': 0, 'deleted': 0}
+        self._values = self._get_initial_values(initial)
+        schema = get_schema(self.__class__, FieldGroupSchema)
+        self._fields = dict(schema.fields)  # copied, since add/remove buttons are added below
+        self._field_order = list(schema.field_order)
         headers = [self._fields[field_name].verbose_name for field_name in self._field_order]
         if self.show_remove_button:
             key = '1__'
@@ -392,58 +1127,382 @@ class Formset(QtGui.QTreeWidget):
         for column, width in enumerate(list_of_widths):
             self.setColumnWidth(column, width)
 
-    def insert_item(self, values: dict, index: int or None=None) -> QtGui.QTreeWidgetItem:
+    def item_count(self) -> int:
+        return self.topLevelItemCount()
+
+    def _create_item(self) -> QtGui.QTreeWidgetItem:
         item = QtGui.QTreeWidgetItem([''] * len(self._field_order), QtGui.QTreeWidgetItem.Type)
         item.setFlags(QtCore.Qt.ItemIsEnabled)
-        if index is None:
-            self.addTopLevelItem(item)
-        else:
-            self.insertTopLevelItem(index, item)
+        return item
+
+    def _acquire_item(self) -> QtGui.QTreeWidgetItem:
+        if self._item_pool:
+            item, widgets = self._item_pool.pop()
+            self._item_widgets[item] = widgets
+            self._widget_counters['reused'] += len(widgets)
+            return item
+        return self._create_item()
+
+    def _create_item_widgets(self, item: QtGui.QTreeWidgetItem, values: dict) -> None:
+        widgets = self._item_widgets.get(item)  # widgets of a reused item
+        if widgets is None:
+            widgets = [self._create_widget(self._fields[field_name], item) for field_name in self._field_order]
+            if self.recycle_widgets:
+                self._item_widgets[item] = widgets
         for column, field_name in enumerate(self._field_order):
             field = self._fields[field_name]
-            widget = field.get_widget(item, self)
-            """:type: QtGui.QWidget"""
+            widget = widgets[column]
             field.set_widget_value(widget, values.get(field_name, field.default))
             self.setItemWidget(item, column, widget)
+        self._modified_items.add(item)
+
+    def _create_widget(self, field: Field, item: QtGui.QTreeWidgetItem) -> QtGui.QWidget:
+        widget = field.get_widget(item, self)
+        """:type: QtGui.QWidget"""
+        self._widget_counters['created'] += 1
+        signal = field.get_change_signal(widget)
+        if signal is not None:
+            # noinspection PyUnresolvedReferences
+            signal.connect(functools.partial(self._widget_modified, widget))
+        self._widget_items[widget] = item
+        return widget
+
+    def _release_item_widgets(self, item: QtGui.QTreeWidgetItem) -> None:
+        """ Put a removed item into the pool with its widgets, if there is some room left (must be called before
+        removing the item from the view) """
+        widgets = self._item_widgets.pop(item, None)
+        if widgets is None or len(self._item_pool) >= self.item_pool_size:  # widgets are deleted by the view
+            for column in range(len(self._field_order)):
+                self._widget_items.pop(self.itemWidget(item, column), None)
+            self._widget_counters['deleted'] += len(self._field_order)
+            return
+        invalid_columns = self._item_errors.get(item, {})
+        for column, widget in enumerate(widgets):
+            if column in invalid_columns:
+                self._fields[self._field_order[column]].set_widget_valid(widget, True, '')
+            # the view deletes the widget when it is removed: cancel this deletion to keep it for the next item
+            self.removeItemWidget(item, column)
+            QtCore.QCoreApplication.removePostedEvents(widget, QtCore.QEvent.DeferredDelete)
+            widget.hide()
+        self._item_pool.append((item, widgets))
+        self._widget_counters['released'] += len(widgets)
+
+    def get_widget_counters(self) -> dict:
+        """ Return the number of widgets 'created', 'reused' (taken from the pool), 'released' (put in the pool) or
+        'deleted', and the number of widgets currently in the pool ('pooled') """
+        counters = dict(self._widget_counters)
+        counters['pooled'] = sum(len(widgets) for (item, widgets) in self._item_pool)
+        return counters
+
+    def get_item_widget(self, item: QtGui.QTreeWidgetItem, column: int) -> QtGui.QWidget:
+        if self.recycle_widgets:
+            return self._item_widgets[item][column]
+        return self.itemWidget(item, column)
+
+    def _widget_modified(self, widget: QtGui.QWidget, *args) -> None:
+        item = self._widget_items.get(widget)
+        if item is not None:
+            self._modified_items.add(item)
+
+    def _forget_item(self, item: QtGui.QTreeWidgetItem) -> None:
+        self._release_item_widgets(item)
+        self._modified_items.discard(item)
+        self._item_errors.pop(item, None)
+
+    def _forget_all_items(self) -> None:
+        for index in range(self.topLevelItemCount()):
+            self._release_item_widgets(self.topLevelItem(index))
+        self._modified_items = set()
+        self._item_errors = {}
+
+    def _remove_all_items(self) -> None:
+        self._forget_all_items()
+        if self._item_pool:  # `clear` would also delete pooled items
+            self.invisibleRootItem().takeChildren()
+        else:
+            self.clear()
+
+    def insert_item(self, values: dict, index: int or None=None) -> QtGui.QTreeWidgetItem:
+        item = self._acquire_item()
+        if index is None:
+            self.addTopLevelItem(item)
+        else:
+            self.insertTopLevelItem(index, item)
+        self._create_item_widgets(item, values)
         return item
 
+    def _suspend_updates(self) -> bool:
+        """ Stop repainting the formset and emitting signals, until `_resume_updates` is called """
+        self.setUpdatesEnabled(False)
+        return self.blockSignals(True)
+
+    def _resume_updates(self, signals_blocked: bool) -> None:
+        self.blockSignals(signals_blocked)
+        self.setUpdatesEnabled(True)
+
+    def extend(self, rows: list) -> list:
+        """ Append several items at once, with a single insertion and a single repaint.
+        :param rows: list of dictionnaries {field_name: field_value}
+        :return: list of new QTreeWidgetItem
+        """
+        rows = list(rows)
+        if not rows or not self._can_add_items(self.topLevelItemCount(), len(rows)):
+            return []
+        signals_blocked = self._suspend_updates()
+        try:
+            return self._append_items(rows)
+        finally:
+            self._resume_updates(signals_blocked)
+
+    def _append_items(self, rows: list) -> list:
+        items = [self._acquire_item() for values in rows]
+        self.addTopLevelItems(items)
+        for item, values in zip(items, rows):
+            self._create_item_widgets(item, values)
+        return items
+
+    def replace_all(self, rows: list) -> None:
+        """ Replace all items by `rows` (completed or truncated with respect to `min_number` and `max_number`) """
+        rows = self._get_initial_values(list(rows))
+        signals_blocked = self._suspend_updates()
+        try:
+            self._remove_all_items()
+            self._append_items(rows)
+        finally:
+            self._resume_updates(signals_blocked)
+
+    def remove_range(self, start: int, stop: int) -> None:
+        """ Remove items from `start` (included) to `stop` (excluded) """
+        item_count = self.topLevelItemCount()
+        start, stop = max(0, start), min(stop, item_count)
+        if start >= stop or not self._can_remove_items(item_count, stop - start):
+            return
+        signals_blocked = self._suspend_updates()
+        try:
+            if start == 0 and stop == item_count:
+                self._remove_all_items()
+            else:
+                for index in range(stop - 1, start - 1, -1):
+                    self._forget_item(self.topLevelItem(index))
+                    self.takeTopLevelItem(index)
+        finally:
+            self._resume_updates(signals_blocked)
+
     def add_item(self, item: QtGui.QTreeWidgetItem) -> None:
-        if self.max_number is not None and self.topLevelItemCount() >= self.max_number:
-            warning(_('Unable to add item'), _('Unable to add more than %(s)d items.') % {'s': self.max_number},
-                    only_ok=True)
+        if not self._can_add_items(self.topLevelItemCount()):
             return
         index = self.indexOfTopLevelItem(item)
         self.insert_item(values={}, index=index)
 
     def remove_item(self, item: QtGui.QTreeWidgetItem) -> None:
-        if self.min_number is not None and self.topLevelItemCount() <= self.min_number:
-            warning(_('Unable to remove item'), _('At least %(s)d items are required.') % {'s': self.min_number},
-                    only_ok=True)
+        if not self._can_remove_items(self.topLevelItemCount()):
             return
         index = self.indexOfTopLevelItem(item)
+        self._forget_item(item)
         self.takeTopLevelItem(index)
 
     def set_item_values(self, item: QtGui.QTreeWidgetItem, values: dict) -> None:
         for column, field_name in enumerate(self._field_order):
             field = self._fields[field_name]
-            widget = self.itemWidget(item, column)
+            widget = self.get_item_widget(item, column)
             field.set_widget_value(widget, values.get(field_name, field.default))
+        self._modified_items.add(item)
 
     def set_values(self, index: int, values: dict) -> None:
         item = self.topLevelItem(index)
         self.set_item_values(item, values)
 
-    def get_values(self) -> list:
-        values = []
+    def _take_modified_items(self) -> (list, list):
+        items, rows = [], []
+        for index in range(self.topLevelItemCount()):
+            item = self.topLevelItem(index)
+            if item not in self._modified_items:
+                continue
+            data, read_errors = {}, {}
+            for column, field_name in enumerate(self._field_order):
+                field = self._fields[field_name]
+                try:
+                    data[field_name] = field.get_widget_value(self.get_item_widget(item, column))
+                except ValueError as e:  # incomplete input, like "-" in an IntegerField
+                    data[field_name] = None
+                    read_errors[column] = str(e)
+            items.append(item)
+            rows.append(data)
+            self._read_errors[item] = read_errors
+        self._modified_items = set()
+        return items, rows
+
+    def _set_errors(self, keys: list, errors: dict) -> None:
+        errors_by_position = {}
+        for (position, column), msg in errors.items():
+            errors_by_position.setdefault(position, {})[column] = msg
+        for position, item in enumerate(keys):
+            item_errors = self._read_errors.pop(item, {})
+            if item.treeWidget() is not self:  # removed during the validation
+                continue
+            item_errors.update(errors_by_position.get(position, {}))
+            previous_errors = self._item_errors.pop(item, {})
+            if item_errors:
+                self._item_errors[item] = item_errors
+            # only update widgets of invalid cells, and of previously invalid ones
+            for column in set(item_errors) | set(previous_errors):
+                field = self._fields[self._field_order[column]]
+                msg = item_errors.get(column)
+                field.set_widget_valid(self.get_item_widget(item, column), msg is None, msg or '')
+
+    def get_errors(self) -> dict:
+        errors = {}
+        for item, item_errors in self._item_errors.items():
+            index = self.indexOfTopLevelItem(item)
+            for column, msg in item_errors.items():
+                errors[(index, column)] = msg
+        return errors
+
+    def iter_values(self):
         for index in range(self.topLevelItemCount()):
             item = self.topLevelItem(index)
             data = {}
             for column, field_name in enumerate(self._field_order):
                 field = self._fields[field_name]
-                widget = self.itemWidget(item, column)
+                widget = self.get_item_widget(item, column)
                 data[field_name] = field.get_widget_value(widget)
-            values.append(data)
-        return values
+            yield data
+
+    def get_values(self) -> list:
+        return list(self.iter_values())
+
+
+class ModelFormset(BaseFormset, QtGui.QTableView, ThreadedCalls):
+    """ Formset based on a :class:`FormsetModel`: values are stored in the model, and a widget is only created for
+    the edited cell. Suitable for tens of thousands of items.
+    Add and remove actions are available in the context menu.
+    Items can be sorted by clicking on headers, and filtered by `set_filter_text` (see `create_filter_bar`).
+    """
+    model_class = FormsetModel
+    proxy_class = FormsetProxyModel
+    delegate_class = FieldDelegate
+    sortable = True
+    filter_mode = 'substring'  # 'substring' or 'prefix': displayed items have a value containing (or starting with)
+    # the filter text
+
+    def __init__(self, initial: list=None, parent=None):
+        """
+        :param initial: initial values, as a list of dictionnaries {field_name: field_value}
+        """
+        QtGui.QTableView.__init__(self, p(parent))
+        ThreadedCalls.__init__(self)
+        schema = get_schema(self.__class__, FieldGroupSchema)
+        self._fields = schema.fields
+        self._field_order = schema.field_order
+        self._model = self.model_class(self._fields, self._field_order, self._get_initial_values(initial),
+                                       parent=self)
+        self._proxy = self.proxy_class(self._model, filter_mode=self.filter_mode, parent=self)
+        self.setModel(self._proxy)
+        self.setItemDelegate(self.delegate_class(self))
+        self.setEditTriggers(QtGui.QAbstractItemView.DoubleClicked | QtGui.QAbstractItemView.EditKeyPressed |
+                             QtGui.QAbstractItemView.AnyKeyPressed)
+        if not self.show_headers:
+            self.horizontalHeader().hide()
+        if self.sortable:
+            self.horizontalHeader().setSortIndicator(-1, QtCore.Qt.AscendingOrder)  # initially keep the given order
+            self.setSortingEnabled(True)
+        self.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
+        if self.show_add_button:
+            action = QtGui.QAction(get_icon('list-add'), _('Add'), self)
+            action.setToolTip(self.add_help_text)
+            # noinspection PyUnresolvedReferences
+            action.triggered.connect(lambda: self.add_item(self._proxy.source_row(self.currentIndex().row())))
+            self.addAction(action)
+        if self.show_remove_button:
+            action = QtGui.QAction(get_icon('list-remove'), _('Remove'), self)
+            action.setToolTip(self.remove_help_text)
+            # noinspection PyUnresolvedReferences
+            action.triggered.connect(lambda: self.remove_item(self._proxy.source_row(self.currentIndex().row())))
+            self.addAction(action)
+        for legend, shortcut, connect in ((_('Copy'), QtGui.QKeySequence.Copy, self.copy_to_clipboard),
+                                          (_('Paste'), QtGui.QKeySequence.Paste, self.paste_from_clipboard)):
+            action = QtGui.QAction(legend, self)
+            action.setShortcut(shortcut)
+            action.setShortcutContext(QtCore.Qt.WidgetShortcut)
+            # noinspection PyUnresolvedReferences
+            action.triggered.connect(connect)
+            self.addAction(action)
+
+    def set_column_widths(self, list_of_widths: list) -> None:
+        for column, width in enumerate(list_of_widths):
+            self.setColumnWidth(column, width)
+
+    def item_count(self) -> int:
+        return self._model.rowCount()
+
+    def set_filter_text(self, text: str) -> None:
+        """ Only display items with a value matching `text` (all items if `text` is empty) """
+        self._proxy.set_filter_text(text)
+
+    def create_filter_bar(self, parent=None) -> SearchEdit:
+        """ Return a new search field, filtering items as the user types """
+        search_edit = SearchEdit(p(parent))
+        # noinspection PyUnresolvedReferences
+        search_edit.textChanged.connect(self.set_filter_text)
+        return search_edit
+
+    def add_item(self, index: int=-1) -> None:
+        """ Insert a new item (with default values) before the item `index`, or at the end if `index` is -1 """
+        item_count = self._model.rowCount()
+        if not self._can_add_items(item_count):
+            return
+        self._model.insert_rows(item_count if index < 0 else index, [{}])
+
+    def remove_item(self, index: int) -> None:
+        if index < 0 or not self._can_remove_items(self._model.rowCount()):
+            return
+        self._model.remove_rows(index, 1)
+
+    def set_values(self, index: int, values: dict) -> None:
+        self._model.set_row_values(index, values)
+
+    def extend(self, rows: list) -> None:
+        """ Append several items at once, in a single model transaction """
+        rows = list(rows)
+        if not rows or not self._can_add_items(self._model.rowCount(), len(rows)):
+            return
+        self._model.insert_rows(self._model.rowCount(), rows)
+
+    def replace_all(self, rows: list) -> None:
+        """ Replace all items by `rows` (completed or truncated with respect to `min_number` and `max_number`) """
+        self._model.reset_rows(self._get_initial_values(list(rows)))
+
+    def remove_range(self, start: int, stop: int) -> None:
+        """ Remove items from `start` (included) to `stop` (excluded) """
+        item_count = self._model.rowCount()
+        start, stop = max(0, start), min(stop, item_count)
+        if start >= stop or not self._can_remove_items(item_count, stop - start):
+            return
+        self._model.remove_rows(start, stop - start)
+
+    def get_values(self) -> list:
+        return self._model.get_rows()
+
+    def iter_values(self):
+        for row in range(self._model.rowCount()):
+            yield self._model.row_values(row)
+
+    def _get_copied_values(self):
+        """ Selected items (in displayed order), or all items if none is selected """
+        rows = sorted({index.row() for index in self.selectionModel().selectedIndexes()})
+        if not rows:
+            return self.iter_values()
+        return (self._model.row_values(self._proxy.source_row(row)) for row in rows)
+
+    def _take_modified_items(self) -> (list, list):
+        keys = self._model.take_modified_rows()
+        return keys, [dict(values) for values in keys]  # copies, since they may be validated in another thread
+
+    def _set_errors(self, keys: list, errors: dict) -> None:
+        self._model.set_errors(keys, errors)
+
+    def get_errors(self) -> dict:
+        return dict(self._model.get_errors())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,513 @@
+# coding=utf-8
+import bisect
+from PySide import QtCore, QtGui
+
+__author__ = 'flanker'
+
+invalid_brush = QtGui.QBrush(QtGui.QColor(207, 0, 0))
+
+
+class ChoiceListModel(QtCore.QAbstractListModel):
+    """ Read-only list model on a list of (value, text) choices.
+    Built once and shared by all widgets displaying these choices, with constant-time lookup of the row of a value.
+    Values are indexed by (type, value), so that equal values of different types (like 1 and True) are distinct choices.
+    """
+
+    def __init__(self, choices, parent=None):
+        QtCore.QAbstractListModel.__init__(self, parent)
+        self._values = []
+        self._texts = []
+        self._rows_by_value = {}
+        self._rows_by_text = {}
+        self._unhashable_values = []  # (row, value) for values that cannot be indexed (lists, dicts)
+        for row, (value, text) in enumerate(choices):
+            self._values.append(value)
+            self._texts.append(text)
+            self._rows_by_text.setdefault(text, row)
+            try:
+                self._rows_by_value.setdefault((type(value), value), row)
+            except TypeError:
+                self._unhashable_values.append((row, value))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._values)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole or role == QtCore.Qt.EditRole:
+            return self._texts[index.row()]
+        elif role == QtCore.Qt.UserRole:
+            return self._values[index.row()]
+        return None
+
+    def value(self, row: int):
+        if 0 <= row < len(self._values):
+            return self._values[row]
+        return None
+
+    def row_of_value(self, value) -> int:
+        """ Return the row of `value`, or -1 if `value` is not a valid choice """
+        try:
+            return self._rows_by_value.get((type(value), value), -1)
+        except TypeError:
+            for row, other_value in self._unhashable_values:
+                if type(other_value) is type(value) and other_value == value:
+                    return row
+            return -1
+
+    def row_of_text(self, text: str) -> int:
+        """ Return the row of the first choice displayed as `text`, or -1 """
+        return self._rows_by_text.get(text, -1)
+
+    def text(self, row: int) -> str:
+        if 0 <= row < len(self._texts):
+            return self._texts[row]
+        return None
+
+
+class FormsetModel(QtCore.QAbstractTableModel):
+    """ Table model on a list of rows (dictionnaries {field_name: value}), with one column per field.
+    Only values are stored: editors are created by a :class:`FieldDelegate`, and only for the edited cell.
+    """
+
+    def __init__(self, fields: dict, field_order: list, rows: list, parent=None):
+        """
+        :param fields: {field_name: Field}
+        :param field_order: list of field names, one per column
+        :param rows: list of dictionnaries {field_name: value}
+        """
+        QtCore.QAbstractTableModel.__init__(self, parent)
+        self._fields = fields
+        self._field_order = field_order
+        self._columns = [fields[field_name] for field_name in field_order]
+        self._rows = rows
+        self._modified_rows = set(range(len(rows)))  # rows modified since the last validation
+        self._errors = {}  # {(row, column): error message}
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._columns)
+
+    def field(self, column: int):
+        return self._columns[column]
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        field = self._columns[index.column()]
+        if role == QtCore.Qt.DisplayRole:
+            return field.get_display_value(self._rows[index.row()][field.name])
+        elif role == QtCore.Qt.EditRole:
+            return self._rows[index.row()][field.name]
+        elif role == QtCore.Qt.ToolTipRole:
+            return self._errors.get((index.row(), index.column()), field.help_text)
+        elif role == QtCore.Qt.BackgroundRole and (index.row(), index.column()) in self._errors:
+            return invalid_brush
+        return None
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid() or role != QtCore.Qt.EditRole:
+            return False
+        field = self._columns[index.column()]
+        self._rows[index.row()][field.name] = value
+        self._modified_rows.add(index.row())
+        # noinspection PyUnresolvedReferences
+        self.dataChanged.emit(index, index)
+        return True
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return str(self._columns[section].verbose_name)
+        return str(section + 1)
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        if self._columns[index.column()].disabled:
+            return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEditable
+
+    def row_values(self, row: int) -> dict:
+        return self._rows[row]
+
+    def set_row_values(self, row: int, values: dict) -> None:
+        self._rows[row] = {field.name: values.get(field.name, field.default) for field in self._columns}
+        self._modified_rows.add(row)
+        # noinspection PyUnresolvedReferences
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self._columns) - 1))
+
+    def insert_rows(self, row: int, rows: list) -> None:
+        """ Insert new rows before `row`. Missing values are replaced by the default value of the field. """
+        if not rows:
+            return
+        rows = [{field.name: values.get(field.name, field.default) for field in self._columns} for values in rows]
+        self.beginInsertRows(QtCore.QModelIndex(), row, row + len(rows) - 1)
+        self._rows[row:row] = rows
+        self._shift_rows(row, len(rows))
+        self._modified_rows.update(range(row, row + len(rows)))
+        self.endInsertRows()
+
+    def remove_rows(self, row: int, count: int=1) -> None:
+        if count <= 0:
+            return
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row + count - 1)
+        del self._rows[row:row + count]
+        self._shift_rows(row, -count)
+        self.endRemoveRows()
+
+    def _shift_rows(self, row: int, offset: int) -> None:
+        """ Update the row numbers of modified rows and errors after the insertion (offset > 0) or the removal
+        (offset < 0) of rows at `row` """
+        stop = row - offset  # removed rows are in range(row, stop), empty for insertions
+        self._modified_rows = {(x if x < row else x + offset) for x in self._modified_rows if not row <= x < stop}
+        self._errors = {((x if x < row else x + offset), column): msg for ((x, column), msg) in self._errors.items()
+                        if not row <= x < stop}
+
+    def reset_rows(self, rows: list) -> None:
+        """ Replace all rows """
+        self.beginResetModel()
+        self._rows = [{field.name: values.get(field.name, field.default) for field in self._columns}
+                      for values in rows]
+        self._modified_rows = set(range(len(self._rows)))
+        self._errors = {}
+        self.endResetModel()
+
+    def get_rows(self) -> list:
+        return [dict(values) for values in self._rows]
+
+    def take_modified_rows(self) -> list:
+        """ Return the rows (dictionnaries) modified since the last call, and forget them """
+        rows = [self._rows[row] for row in sorted(self._modified_rows)]
+        self._modified_rows = set()
+        return rows
+
+    def set_errors(self, rows: list, errors: dict) -> None:
+        """ Replace the errors of validated rows. Rows are identified by their dictionnary, since rows may have been
+        inserted or removed during the validation.
+        :param rows: list of validated rows, as returned by `take_modified_rows`
+        :param errors: {(position in `rows`, column): error message}
+        """
+        current_rows = {id(values): row for (row, values) in enumerate(self._rows)}
+        validated_rows = {}  # {position in `rows`: current row}
+        for position, values in enumerate(rows):
+            row = current_rows.get(id(values))
+            if row is not None:
+                validated_rows[position] = row
+        if not validated_rows:
+            return
+        updated_rows = set(validated_rows.values())
+        self._errors = {key: msg for (key, msg) in self._errors.items() if key[0] not in updated_rows}
+        for (position, column), msg in errors.items():
+            if position in validated_rows:
+                self._errors[(validated_rows[position], column)] = msg
+        # noinspection PyUnresolvedReferences
+        self.dataChanged.emit(self.index(min(updated_rows), 0),
+                              self.index(max(updated_rows), len(self._columns) - 1))
+
+    def get_errors(self) -> dict:
+        return self._errors
+
+    def column_values(self, column: int) -> list:
+        field_name = self._field_order[column]
+        return [values[field_name] for values in self._rows]
+
+
+class FormsetProxyModel(QtCore.QAbstractTableModel):
+    """ Sorted and filtered view of a :class:`FormsetModel`.
+    Sort keys (given by `Field.get_sort_key`) and search texts are computed once, and only updated for modified cells.
+    Results of recent filters are kept: a new filter text only scans the rows matching a shorter filter text it
+    contains (typically, the previous text while the user is typing).
+    Modified rows are not moved nor hidden until the next call to `sort` or `set_filter_text`.
+    """
+    filter_cache_size = 32
+    update_cache_size = 1000  # when more rows are modified at once, cached sort keys and search texts are dropped
+
+    def __init__(self, source: FormsetModel, filter_mode: str='substring', parent=None):
+        """
+        :param filter_mode: 'substring' (rows with a value containing the filter text) or 'prefix' (rows with a
+            value starting with the filter text)
+        """
+        QtCore.QAbstractTableModel.__init__(self, parent)
+        self._source = source
+        self.filter_mode = filter_mode
+        self._rows = None  # list of displayed source rows, or None if all source rows are displayed in their order
+        self._sort_column = -1
+        self._sort_order = QtCore.Qt.AscendingOrder
+        self._filter_text = ''
+        self._sort_keys = {}  # {column: list of sort keys}
+        self._search_texts = None  # list of '\n'-separated displayed values (lower case), one per source row
+        self._filter_cache = {}  # {searched text: list of matching source rows}
+        # noinspection PyUnresolvedReferences
+        source.dataChanged.connect(self._source_data_changed)
+        # noinspection PyUnresolvedReferences
+        source.rowsAboutToBeInserted.connect(self._source_rows_about_to_be_inserted)
+        # noinspection PyUnresolvedReferences
+        source.rowsInserted.connect(self._source_rows_inserted)
+        # noinspection PyUnresolvedReferences
+        source.rowsAboutToBeRemoved.connect(self._source_rows_about_to_be_removed)
+        # noinspection PyUnresolvedReferences
+        source.rowsRemoved.connect(self._source_rows_removed)
+        # noinspection PyUnresolvedReferences
+        source.modelAboutToBeReset.connect(self.beginResetModel)
+        # noinspection PyUnresolvedReferences
+        source.modelReset.connect(self._source_reset)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self._rows is None:
+            return self._source.rowCount()
+        return len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return self._source.columnCount(parent)
+
+    def field(self, column: int):
+        return self._source.field(column)
+
+    def source_row(self, row: int) -> int:
+        if self._rows is None or row < 0:
+            return row
+        return self._rows[row]
+
+    def _source_index(self, index):
+        return self._source.index(self.source_row(index.row()), index.column())
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        return self._source.data(self._source_index(index), role)
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid():
+            return False
+        return self._source.setData(self._source_index(index), value, role)
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        return self._source.flags(self._source_index(index))
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Vertical:
+            section = self.source_row(section)
+        return self._source.headerData(section, orientation, role)
+
+    def sort(self, column: int, order=QtCore.Qt.AscendingOrder):
+        """ Sort rows by `column`, or restore the order of the source model if `column` is -1 """
+        self.layoutAboutToBeChanged.emit()
+        persistent_indexes = self.persistentIndexList()
+        source_rows = [self.source_row(index.row()) for index in persistent_indexes]
+        self._sort_column = column
+        self._sort_order = order
+        self._update_rows()
+        if persistent_indexes:
+            if self._rows is None:
+                new_rows = source_rows
+            else:
+                rows_by_source_row = {source_row: row for (row, source_row) in enumerate(self._rows)}
+                new_rows = [rows_by_source_row[source_row] for source_row in source_rows]
+            self.changePersistentIndexList(persistent_indexes, [self.index(row, index.column()) for (row, index)
+                                                                in zip(new_rows, persistent_indexes)])
+        self.layoutChanged.emit()
+
+    def set_filter_text(self, text: str) -> None:
+        self.beginResetModel()
+        self._filter_text = text
+        self._update_rows()
+        self.endResetModel()
+
+    def _update_rows(self):
+        rows = None
+        if self._filter_text:
+            rows = list(self._get_filtered_rows(self._filter_text))  # the cached list must not be modified
+        if self._sort_column >= 0:
+            keys = self._get_sort_keys(self._sort_column)
+            if rows is None:
+                rows = range(len(keys))
+            rows = sorted(rows, key=keys.__getitem__, reverse=self._sort_order == QtCore.Qt.DescendingOrder)
+        self._rows = rows
+
+    def _get_sort_keys(self, column: int) -> list:
+        keys = self._sort_keys.get(column)
+        if keys is None:
+            field = self._source.field(column)
+            keys = [field.get_sort_key(value) for value in self._source.column_values(column)]
+            self._sort_keys[column] = keys
+        return keys
+
+    def _get_search_text(self, row: int) -> str:
+        values = self._source.row_values(row)
+        return '\n' + '\n'.join([field.get_display_value(values[field.name]).lower() for field in self._get_fields()])
+
+    def _get_fields(self) -> list:
+        return [self._source.field(column) for column in range(self._source.columnCount())]
+
+    def _get_filtered_rows(self, text: str) -> list:
+        searched = text.lower() if self.filter_mode == 'substring' else '\n' + text.lower()
+        cache = self._filter_cache
+        if searched in cache:
+            return cache[searched]
+        if self._search_texts is None:
+            columns = [[field.get_display_value(value).lower() for value in self._source.column_values(column)]
+                       for (column, field) in enumerate(self._get_fields())]
+            self._search_texts = ['\n' + '\n'.join(texts) for texts in zip(*columns)]
+        texts = self._search_texts
+        # rows matching `searched` also match any text it contains: only scan the smallest cached result
+        candidates = range(len(texts))
+        for cached_text, cached_rows in cache.items():
+            if cached_text in searched and len(cached_rows) < len(candidates):
+                candidates = cached_rows
+        rows = [row for row in candidates if searched in texts[row]]
+        if len(cache) >= self.filter_cache_size:
+            del cache[next(iter(cache))]
+        cache[searched] = rows
+        return rows
+
+    def _source_data_changed(self, top_left, bottom_right):
+        first_row, last_row = top_left.row(), bottom_right.row()
+        if last_row - first_row >= self.update_cache_size:
+            self._clear_cache()  # cheaper to rebuild it on the next sort or filter
+        else:
+            for column in range(top_left.column(), bottom_right.column() + 1):
+                keys = self._sort_keys.get(column)
+                if keys is not None:
+                    field = self._source.field(column)
+                    for row in range(first_row, last_row + 1):
+                        keys[row] = field.get_sort_key(self._source.row_values(row)[field.name])
+            if self._search_texts is not None:
+                for row in range(first_row, last_row + 1):
+                    self._search_texts[row] = self._get_search_text(row)
+            self._filter_cache = {}
+        if self._rows is None:
+            self.dataChanged.emit(self.index(first_row, top_left.column()),
+                                  self.index(last_row, bottom_right.column()))
+        else:
+            self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount() - 1, self.columnCount() - 1))
+
+    def _clear_cache(self):
+        self._sort_keys = {}
+        self._search_texts = None
+        self._filter_cache = {}
+
+    def _get_insert_position(self, first: int) -> int:
+        """ Row of the first item inserted at `first` in the source model: new items are displayed after the other
+        ones when rows are sorted, and in the source order otherwise """
+        if self._sort_column >= 0:
+            return len(self._rows)
+        return bisect.bisect_left(self._rows, first)
+
+    def _source_rows_about_to_be_inserted(self, parent, first: int, last: int):
+        if self._rows is None:
+            self.beginInsertRows(QtCore.QModelIndex(), first, last)
+        else:
+            position = self._get_insert_position(first)
+            self.beginInsertRows(QtCore.QModelIndex(), position, position + last - first)
+
+    def _source_rows_about_to_be_removed(self, parent, first: int, last: int):
+        if self._rows is None:
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            return
+        # removed items may be displayed in several blocks of consecutive rows: remove them from the last one
+        removed_rows = [row for (row, source_row) in enumerate(self._rows) if first <= source_row <= last]
+        while removed_rows:
+            end = removed_rows.pop()
+            start = end
+            while removed_rows and removed_rows[-1] == start - 1:
+                start = removed_rows.pop()
+            self.beginRemoveRows(QtCore.QModelIndex(), start, end)
+            del self._rows[start:end + 1]
+            self.endRemoveRows()
+
+    def _source_rows_inserted(self, parent, first: int, last: int):
+        count = last - first + 1
+        if count > self.update_cache_size:
+            self._clear_cache()
+        else:
+            new_rows = range(first, last + 1)
+            for column, keys in self._sort_keys.items():
+                field = self._source.field(column)
+                keys[first:first] = [field.get_sort_key(self._source.row_values(row)[field.name]) for row in new_rows]
+            if self._search_texts is not None:
+                new_texts = [self._get_search_text(row) for row in new_rows]
+                self._search_texts[first:first] = new_texts
+                for searched, rows in self._filter_cache.items():
+                    index = bisect.bisect_left(rows, first)
+                    self._filter_cache[searched] = rows[:index] + \
+                        [row for (row, text) in zip(new_rows, new_texts) if searched in text] + \
+                        [row + count for row in rows[index:]]
+        if self._rows is None:
+            self.endInsertRows()
+        else:
+            position = self._get_insert_position(first)
+            self._rows = [row + count if row >= first else row for row in self._rows]
+            self._rows[position:position] = range(first, last + 1)
+            self.endInsertRows()
+
+    def _source_rows_removed(self, parent, first: int, last: int):
+        count = last - first + 1
+        if count > self.update_cache_size:
+            self._clear_cache()
+        else:
+            for keys in self._sort_keys.values():
+                del keys[first:last + 1]
+            if self._search_texts is not None:
+                del self._search_texts[first:last + 1]
+            for searched, rows in self._filter_cache.items():
+                start, end = bisect.bisect_left(rows, first), bisect.bisect_right(rows, last)
+                self._filter_cache[searched] = rows[:start] + [row - count for row in rows[end:]]
+        if self._rows is None:
+            self.endRemoveRows()
+        else:  # removed rows are already hidden
+            self._rows = [row - count if row > last else row for row in self._rows]
+
+    def _source_reset(self):
+        self._clear_cache()
+        self._update_rows()
+        self.endResetModel()
+
+
+class FieldDelegate(QtGui.QStyledItemDelegate):
+    """ Item delegate of a :class:`FormsetModel`: the editor of a cell is the widget of its field, only created while
+    the cell is edited.
+    """
+
+    def createEditor(self, parent, option, index):
+        field = index.model().field(index.column())
+        editor = field.get_widget(index.row(), parent)
+        # widgets are created as children of the application window (see `p`): editors must be in the viewport
+        editor.setParent(parent)
+        editor.setAutoFillBackground(True)
+        return editor
+
+    def setEditorData(self, editor, index):
+        field = index.model().field(index.column())
+        field.set_widget_value(editor, index.model().data(index, QtCore.Qt.EditRole))
+
+    def setModelData(self, editor, model, index):
+        field = model.field(index.column())
+        try:
+            value = field.get_widget_value(editor)
+        except ValueError:  # incomplete input, like "-" in an IntegerField: keep the previous value
+            return
+        model.setData(index, value, QtCore.Qt.EditRole)
+
+    def updateEditorGeometry(self, editor, option, index):
+        editor.setGeometry(option.rect)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
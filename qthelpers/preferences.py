@@ -1,18 +1,168 @@
 # coding=utf-8
+import contextlib
+import copy
 import json
+import logging
 import os
 import re
+import sqlite3
+import stat
 import sys
+import tempfile
+import threading
 import unicodedata
 
+from PySide import QtCore
+
 from qthelpers.exceptions import InvalidValueException
 from qthelpers.fields import FieldGroup, Field
+from qthelpers.utils import get_schema, ThreadedCalls
 
 __author__ = 'flanker'
+logger = logging.getLogger(__name__)
+
+
+class LazyValues(dict):
+    """ Values of a :class:`Section`. Stored values are removed from the dict until they are read for the first
+    time: they are only deserialized and validated at this moment, by `load_value` """
+
+    def __init__(self, values: dict, load_value: callable):
+        super().__init__(values)
+        self.load_value = load_value
+
+    def __missing__(self, key: str):
+        return self.load_value(key)
 
 
 class Section(FieldGroup):
-    pass
+    """ Group of preferences. Modified keys are tracked, so that unmodified sections are not serialized again.
+    Lists and dicts modified in place are detected by comparison with a copy of their last saved value.
+    Loaded values are only deserialized when they are used.
+    """
+    _track_changes = True
+    _section_name = None  # set by Preferences
+    _notifier = None  # PreferencesNotifier, set by Preferences
+
+    def __init__(self, initial=None, index=None):
+        super().__init__(initial=initial, index=index)
+        self._values = LazyValues(self._values, self._load_value)
+        self._stored_values = {}  # {key: stored value} of keys not yet deserialized
+        self._stored_decoders = {}  # {key: function returning the serialized value} of encoded stored values
+        self._modified_keys = set()
+        self._saved_values = {}  # {key: deep copy of the saved value} for lists and dicts
+        self._mark_saved()
+
+    def _field_changed(self, field_name: str) -> None:
+        super()._field_changed(field_name)
+        self._stored_values.pop(field_name, None)
+        self._stored_decoders.pop(field_name, None)
+        self._modified_keys.add(field_name)
+        if self._notifier is not None:
+            self._notifier.notify(self._section_name, field_name)
+
+    def subscribe(self, callback: callable, key: str=None) -> None:
+        """ Call `callback(section_name, key, value)` in the GUI thread when `key` (or any key of this section if
+        `key` is None) is modified. See :meth:`Preferences.subscribe` """
+        self._get_notifier().subscribe(callback, self._section_name, key)
+
+    def unsubscribe(self, callback: callable, key: str=None) -> None:
+        self._get_notifier().unsubscribe(callback, self._section_name, key)
+
+    def _get_notifier(self) -> 'PreferencesNotifier':
+        if self._notifier is None:
+            raise RuntimeError('%s is not a section of a Preferences instance: changes cannot be subscribed' %
+                               self.__class__.__name__)
+        return self._notifier
+
+    def set_stored_values(self, stored_values: dict, decode: callable=None) -> None:
+        """ Replace the values of this section by stored ones, that will be decoded and deserialized when first read
+        :param stored_values: {key: serialized value}, or {key: encoded value} if `decode` is given
+        :param decode: function returning the serialized value of an encoded value (see `PreferencesStorage.decode`)
+        """
+        for key, stored in stored_values.items():
+            if key in self._fields and not self._fields[key].computed:
+                self._values.pop(key, None)
+                self._saved_values.pop(key, None)
+                self._stored_values[key] = stored
+                if decode is None:
+                    self._stored_decoders.pop(key, None)
+                else:
+                    self._stored_decoders[key] = decode
+
+    def _load_value(self, key: str):
+        """ Deserialize and validate a stored value; a copy of the default value is used if it is invalid """
+        field = self._fields[key]
+        stored = self._stored_values[key]  # KeyError for unknown keys
+        decode = self._stored_decoders.pop(key, None)
+        try:
+            value = field.deserialize(stored if decode is None else decode(stored))
+            field.is_valid(value)
+        except (InvalidValueException, ValueError, TypeError) as e:
+            logger.warning('Invalid stored value of %s/%s (default value used): %s', self._section_name, key, e)
+            value = copy.deepcopy(field.default)
+        del self._stored_values[key]
+        self._values[key] = value
+        if isinstance(value, (list, dict)):
+            self._saved_values[key] = copy.deepcopy(value)
+        return value
+
+    def get_modified_keys(self) -> set:
+        """ Return the keys modified since the last save """
+        modified_keys = set(self._modified_keys)
+        for key, value in self._saved_values.items():
+            if key not in modified_keys and self._values[key] != value:
+                modified_keys.add(key)
+        return modified_keys
+
+    def _mark_saved(self) -> None:
+        self._modified_keys = set()
+        # values not deserialized yet are not copied (and cannot have been modified)
+        self._saved_values = {key: copy.deepcopy(value) for (key, value) in self._values.items()
+                              if isinstance(value, (list, dict))}
+
+    def serialize_values(self, default: bool=False, keys=None) -> dict:
+        """ Return serialized values (default values if `default` is True), except computed ones
+        :param keys: only serialize these keys (all keys if None)
+        """
+        values = {}
+        for key in self._field_order if keys is None else keys:
+            field = self._fields[key]
+            if not field.computed:
+                values[key] = field.serialize(field.default if default else self._values[key])
+        return values
+
+
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def write_file(filename: str, write: callable, mode: str='w') -> None:
+    """ Atomically replace `filename`: `write(fd)` writes to a temporary file in the same directory, which then
+    replaces the original file (a crash cannot leave a truncated file).
+    The permissions of the original file are kept (new files get the usual permissions, given by the umask).
+    """
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    fd, tmp_filename = tempfile.mkstemp(prefix='.%s.' % os.path.basename(filename), suffix='.tmp', dir=dirname)
+    try:
+        try:
+            os.chmod(tmp_filename, stat.S_IMODE(os.stat(filename).st_mode))
+        except FileNotFoundError:
+            os.chmod(tmp_filename, 0o666 & ~_umask)
+        with os.fdopen(fd, mode) as tmp_fd:
+            write(tmp_fd)
+            tmp_fd.flush()
+            os.fsync(tmp_fd.fileno())
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+
+
+def write_json_file(filename: str, data) -> None:
+    """ Atomically replace `filename` by `data`, serialized as JSON """
+    write_file(filename, lambda fd: json.dump(data, fd, ensure_ascii=False, sort_keys=True))
 
 
 class GlobalObject(object):
@@ -29,14 +179,201 @@ class GlobalObject(object):
         super().__setattr__(key, value)
 
     def __getitem__(self, item: str):
-        section, key = item.split('/', 1)
         # noinspection PyProtectedMember
-        return getattr(global_dict[self.__key]._sections[section], key)
+        return global_dict[self.__key]._handles[item].get()
 
     def __setitem__(self, item: str, value):
-        section, key = item.split('/', 1)
         # noinspection PyProtectedMember
-        return setattr(global_dict[self.__key]._sections[section], key, value)
+        global_dict[self.__key]._handles[item].set(value)
+
+
+class PreferencesStorage(object):
+    """ Storage of serialized preferences, as {section name: {key: serialized value}}.
+    Subclasses must implement `read` and `write_values`.
+    """
+    filename_suffix = ''  # appended to the filenames given by `Preferences.application_settings_filenames`
+    decode = None  # function returning the serialized value of a value returned by `read`, if they are encoded
+
+    def __init__(self, filename: str):
+        self.filename = filename + self.filename_suffix
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.filename)
+
+    def read(self) -> dict:
+        """ Return all stored values (encoded if `decode` is not None) """
+        raise NotImplementedError
+
+    def write_values(self, values: dict, replace: bool=False) -> None:
+        """ Store some values, keeping other stored values unless `replace` is True
+        :param values: {section name: {key: serialized value}}
+        """
+        raise NotImplementedError
+
+
+class JSONStorage(PreferencesStorage):
+    """ All values are stored in a single JSON document, rewritten (atomically) by each write. """
+
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        self._document = None  # last read or written document
+
+    def read(self) -> dict:
+        with open(self.filename, 'r') as fd:  # TODO erreurs possibles
+            document = json.load(fd)
+        self._document = document
+        return document
+
+    def write_values(self, values: dict, replace: bool=False) -> None:
+        if replace:
+            document = {}
+        elif self._document is not None:
+            document = self._document
+        elif self.exists():
+            document = self.read()
+        else:
+            document = {}
+        for section_name, section_values in values.items():
+            # the kept document must not share lists or dicts with the caller
+            document[section_name] = dict(document.get(section_name, {}), **copy.deepcopy(section_values))
+        write_json_file(self.filename, document)
+        self._document = document
+
+
+class SQLiteStorage(PreferencesStorage):
+    """ Values are stored in a SQLite database, one row per key (as JSON), so modified keys are written without
+    writing all other values. Large lists or dicts only cost their own row.
+    Values are returned as JSON texts by `read`, and only decoded when they are used. """
+    filename_suffix = '.sqlite3'
+    decode = staticmethod(json.loads)
+
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        self._schema_created = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """ Open a new connection (connections cannot be shared between threads), creating the database first """
+        if self._schema_created:
+            return sqlite3.connect(self.filename)
+        dirname = os.path.dirname(self.filename)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        connection = sqlite3.connect(self.filename)
+        connection.execute('CREATE TABLE IF NOT EXISTS preferences (section TEXT NOT NULL, key TEXT NOT NULL, '
+                           'value TEXT NOT NULL, PRIMARY KEY (section, key))')
+        self._schema_created = True
+        return connection
+
+    def _select(self, query: str, *args) -> list:
+        with contextlib.closing(self._connect()) as connection:
+            return connection.execute(query, args).fetchall()
+
+    def read(self) -> dict:
+        values = {}
+        for section_name, key, value in self._select('SELECT section, key, value FROM preferences'):
+            values.setdefault(section_name, {})[key] = value
+        return values
+
+    def write_values(self, values: dict, replace: bool=False) -> None:
+        rows = [(section_name, key, json.dumps(value, ensure_ascii=False, sort_keys=True))
+                for section_name, section_values in values.items() for (key, value) in section_values.items()]
+        with contextlib.closing(self._connect()) as connection:
+            with connection:  # single transaction
+                if replace:
+                    connection.execute('DELETE FROM preferences')
+                connection.executemany('INSERT OR REPLACE INTO preferences (section, key, value) VALUES (?, ?, ?)',
+                                       rows)
+
+
+class PreferenceHandle(object):
+    """ Accessor of a single preference, given by its path 'SectionName/key'.
+    The section and the field are resolved once, so `get` and `set` do not parse the path again. Handles are
+    returned by :meth:`Preferences.handle`.
+    """
+    __slots__ = ('section', 'field')
+
+    def __init__(self, section: Section, key: str):
+        self.section = section
+        # noinspection PyProtectedMember
+        self.field = section._fields[key]
+
+    def get(self):
+        return self.field.__get__(self.section, None)
+
+    def set(self, value) -> None:
+        self.field.__set__(self.section, value)
+
+    def subscribe(self, callback: callable) -> None:
+        self.section.subscribe(callback, self.field.name)
+
+    def unsubscribe(self, callback: callable) -> None:
+        self.section.unsubscribe(callback, self.field.name)
+
+
+class PreferenceHandles(dict):
+    """ Cache of :class:`PreferenceHandle`, by path """
+
+    def __init__(self, sections: dict):
+        super().__init__()
+        self.sections = sections
+
+    def __missing__(self, path: str) -> PreferenceHandle:
+        section_name, key = path.split('/', 1)
+        handle = PreferenceHandle(self.sections[section_name], key)
+        self[path] = handle
+        return handle
+
+
+class PreferencesNotifier(QtCore.QObject, ThreadedCalls):
+    """ Notify the subscribers of modified preferences, in the GUI thread.
+    Changes are coalesced: subscribers are called once per modified key and per event loop iteration, with the last
+    value of this key.
+    """
+
+    def __init__(self, preferences):
+        QtCore.QObject.__init__(self)
+        ThreadedCalls.__init__(self)
+        self.preferences = preferences
+        self._subscribers = {}  # {(section name or None, key or None): list of callables}
+        self._lock = threading.Lock()  # protects `_changed_keys` and `_scheduled`
+        self._changed_keys = {}  # {(section name, key): None} (used as an ordered set)
+        self._scheduled = False
+
+    def subscribe(self, callback: callable, section_name: str=None, key: str=None) -> None:
+        self._subscribers.setdefault((section_name, key), []).append(callback)
+
+    def unsubscribe(self, callback: callable, section_name: str=None, key: str=None) -> None:
+        subscribers = self._subscribers[(section_name, key)]
+        subscribers.remove(callback)
+        if not subscribers:
+            del self._subscribers[(section_name, key)]
+
+    def notify(self, section_name: str, key: str) -> None:
+        """ Called (from any thread) when a key is modified """
+        if not self._subscribers:
+            return
+        with self._lock:
+            self._changed_keys[(section_name, key)] = None
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.signal_call(QtCore.QTimer.singleShot, 0, self.deliver)
+
+    def deliver(self) -> None:
+        """ Call the subscribers of all keys modified since the last call.
+        Errors raised by a subscriber are logged, and do not prevent the other subscribers to be called.
+        """
+        with self._lock:
+            changed_keys, self._changed_keys, self._scheduled = self._changed_keys, {}, False
+        for section_name, key in changed_keys:
+            # noinspection PyProtectedMember
+            value = self.preferences._handles[section_name + '/' + key].get()
+            for subscriber_key in (section_name, key), (section_name, None), (None, None):
+                for callback in list(self._subscribers.get(subscriber_key, ())):
+                    try:
+                        callback(section_name, key, value)
+                    except Exception:
+                        logger.exception('Error in the subscriber %r of %s/%s', callback, section_name, key)
 
 
 global_dict = {}
@@ -49,6 +386,27 @@ def slugify(value):
     return re.sub(r'[^\w\.-]', '', value).strip()
 
 
+class PreferencesSchema(object):
+    """ Merged :class:`Section` classes of a :class:`Preferences` subclass.
+    All Section classes with the same name in the class hierarchy are merged into a single class.
+    """
+
+    def __init__(self, cls: type):
+        fields_by_section = {}
+        for base in cls.__mro__:
+            for section_name, section_class in base.__dict__.items():
+                if not isinstance(section_class, type) or not issubclass(section_class, Section):
+                    continue
+                fields_by_section.setdefault(section_name, {})
+                for field_name, field in section_class.__dict__.items():
+                    if not isinstance(field, Field) or field_name in fields_by_section[section_name]:
+                        continue
+                    fields_by_section[section_name][field_name] = field
+        self.sections = {section_name: type(section_name, (Section, ), fields)
+                         for section_name, fields in fields_by_section.items()}
+        """:type: dict of [str, type]"""
+
+
 class Preferences(object):
     organization_name = None
     verbose_name = None
@@ -57,36 +415,45 @@ class Preferences(object):
     icon_search_modules = ['qtexample', 'qthelpers', ]
     icon_use_global_theme = True
     organization_domain = None
+    save_delay = 0.5  # in seconds: save requests received during this delay are coalesced into a single write
+    storage_class = JSONStorage  # or SQLiteStorage
 
     def __init__(self):
         self._sections = {}
-        fields_by_section = {}
-        for cls in self.__class__.__mro__:
-            for section_name, section_class in cls.__dict__.items():
-                if not isinstance(section_class, type) or not issubclass(section_class, Section):
-                    continue
-                fields_by_section.setdefault(section_name, {})
-                for field_name, field in section_class.__dict__.items():
-                    if not isinstance(field, Field) or field_name in fields_by_section[section_name]:
-                        continue
-                    fields_by_section[section_name][field_name] = field
-        for section_name, fields in fields_by_section.items():
-            merged_cls = type(section_name, (Section, ), fields)
-            self._sections[section_name] = merged_cls()
+        self._storages = None
+        self._pending_values = {}  # {section name: {key: serialized value}} to write when `_save_timer` expires
+        self._save_lock = threading.Lock()  # protects `_pending_values` and `_save_timer`
+        self._write_lock = threading.Lock()
+        self._save_timer = None
+        self._notifier = PreferencesNotifier(self)
+        self._handles = PreferenceHandles(self._sections)
+        for section_name, merged_cls in get_schema(self.__class__, PreferencesSchema).sections.items():
+            section = merged_cls()
+            section._section_name = section_name
+            section._notifier = self._notifier
+            self._sections[section_name] = section
+            setattr(self, section_name, section)
         global_dict[preferences_key] = self
 
     def __getitem__(self, item: str):
-        section, key = item.split('/', 1)
-        return getattr(self._sections[section], key)
+        return self._handles[item].get()
 
     def __setitem__(self, item: str, value):
-        section, key = item.split('/', 1)
-        return setattr(self._sections[section], key, value)
+        self._handles[item].set(value)
+
+    def handle(self, path: str) -> PreferenceHandle:
+        """ Return a (cached) accessor of the preference 'SectionName/key', faster than `preferences[path]`:
 
-    def __getattribute__(self, item: str):
-        if not item.startswith('_') and item in self._sections:
-            return self._sections[item]
-        return super().__getattribute__(item)
+        >>> from qthelpers.fields import IntegerField
+        >>> class MyPreferences(Preferences):
+        ...     class GlobalInfos(Section):
+        ...         auto_save_interval = IntegerField(default=0)
+        >>> auto_save_interval = MyPreferences().handle('GlobalInfos/auto_save_interval')
+        >>> auto_save_interval.set(10)
+        >>> auto_save_interval.get()
+        10
+        """
+        return self._handles[path]
 
     def application_settings_filenames(self):
         app_name = slugify(self.verbose_name)
@@ -101,59 +468,98 @@ class Preferences(object):
             allusers = '/etc/%s/%s.plist' % (self.organization_name, app_name)
         return home, allusers
 
-    def save(self):
-        home, allusers = self.application_settings_filenames()
-        dirname = os.path.dirname(home)
-        if not os.path.isdir(dirname):  # TODO erreurs possibles
-            os.makedirs(dirname)
-        all_values = {}
+    def subscribe(self, callback: callable, section_name: str=None, key: str=None) -> None:
+        """ Call `callback(section_name, key, value)` when a preference is modified (by assignment: lists or dicts
+        modified in place are not notified).
+        Subscribers are called in the GUI thread, once per event loop iteration for all modifications of a key.
+        :param callback: callable
+        :param section_name: only notify changes of this section (any section if None)
+        :param key: only notify changes of this key (any key of the section if None)
+        """
+        self._notifier.subscribe(callback, section_name, key)
+
+    def unsubscribe(self, callback: callable, section_name: str=None, key: str=None) -> None:
+        self._notifier.unsubscribe(callback, section_name, key)
+
+    def get_storages(self) -> (PreferencesStorage, PreferencesStorage):
+        """ Return the storages of the user preferences and of the preferences shared by all users """
+        if self._storages is None:
+            home, allusers = self.application_settings_filenames()
+            self._storages = self.storage_class(home), self.storage_class(allusers)
+        return self._storages
+
+    def save(self) -> bool:
+        """ Request a save of the modified preferences, and return False if nothing has been modified.
+        Modified values are serialized immediately, but they are written in a background thread after `save_delay`:
+        all requests received in the meantime are coalesced into this single write. If this write fails (the error is
+        reported by `threading.excepthook`), values are written again by the next save or by `flush`.
+        """
+        modified_values = {}
         for section_name, section in self._sections.items():
-            all_values[section_name] = {}
-            # noinspection PyProtectedMember
-            for key in section._field_order:
+            modified_keys = section.get_modified_keys()
+            if modified_keys:
+                # serialized lists and dicts are the values themselves: they are copied, since they are written
+                # in another thread while they can be modified in place
+                modified_values[section_name] = copy.deepcopy(section.serialize_values(keys=modified_keys))
                 # noinspection PyProtectedMember
-                serialized = section._fields[key].serialize(section._values[key])
-                all_values[section_name][key] = serialized
-        with open(home, 'w') as fd:  # TODO erreurs possibles
-            json.dump(all_values, fd, ensure_ascii=False, sort_keys=True)
+                section._mark_saved()
+        if not modified_values:
+            return False
+        with self._save_lock:
+            for section_name, values in modified_values.items():
+                self._pending_values.setdefault(section_name, {}).update(values)
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_delay, self._write_pending_values)
+                self._save_timer.start()
+        return True
+
+    def _write_pending_values(self) -> None:
+        """ Write pending values. If the write fails, they are kept for the next write and the error is raised. """
+        with self._write_lock:
+            with self._save_lock:
+                values, self._pending_values, self._save_timer = self._pending_values, {}, None
+            if not values:  # already written by `flush`
+                return
+            try:
+                self.get_storages()[0].write_values(values)
+            except Exception:
+                with self._save_lock:  # values saved in the meantime are more recent
+                    for section_name, section_values in values.items():
+                        section_values.update(self._pending_values.get(section_name, {}))
+                        self._pending_values[section_name] = section_values
+                raise
+
+    def flush(self) -> None:
+        """ Immediately write pending values, instead of waiting for `save_delay`.
+        Write errors (OSError) are raised, and values that could not be written (including by a previous background
+        write) are kept for the next write.
+        """
+        with self._save_lock:
+            timer = self._save_timer
+        if timer is not None:
+            timer.cancel()
+        self._write_pending_values()
 
     def reset(self):
-        home, allusers = self.application_settings_filenames()
-        dirname = os.path.dirname(home)
-        if not os.path.isdir(dirname):  # TODO erreurs possibles
-            os.makedirs(dirname)
-        all_values = {}
-        for section_name, section in self._sections.items():
-            all_values[section_name] = {}
-            # noinspection PyProtectedMember
-            for key in section._field_order:
-                # noinspection PyProtectedMember
-                serialized = section._fields[key].serialize(section._fields[key].default)
-                all_values[section_name][key] = serialized
-        with open(home, 'w') as fd:  # TODO erreurs possibles
-            json.dump(all_values, fd, ensure_ascii=False, sort_keys=True)
+        """ Write the default values of all preferences, replacing stored ones (OSError is raised on error) """
+        with self._write_lock:
+            with self._save_lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                self._pending_values, self._save_timer = {}, None
+            values = {section_name: section.serialize_values(default=True)
+                      for section_name, section in self._sections.items()}
+            self.get_storages()[0].write_values(values, replace=True)
 
     def load(self):
-        home, allusers = self.application_settings_filenames()
-        for filename in home, allusers:
-            if not os.path.isfile(filename):
+        """ Read stored values; they are deserialized (and validated) when they are read for the first time """
+        for storage in self.get_storages():  # values of the last storages replace the previous ones
+            if not storage.exists():
                 continue
-            with open(filename, 'r') as fd:  # TODO erreurs possibles
-                all_values = json.load(fd)
-            for section_name, section in self._sections.items():
-                if section_name not in all_values:
-                    continue
-                # noinspection PyProtectedMember
-                for key in section._field_order:
-                    if key not in all_values[section_name]:
-                        continue
-                    serialized = all_values[section_name][key]
-                    # noinspection PyProtectedMember
-                    deserialized = section._fields[key].deserialize(serialized)
-                    try:
-                        setattr(section, key, deserialized)
-                    except InvalidValueException:  # TODO log the error
-                        pass
+            for section_name, section_values in storage.read().items():
+                if section_name in self._sections:
+                    self._sections[section_name].set_stored_values(section_values, decode=storage.decode)
+
 
 if __name__ == '__main__':
     import doctest
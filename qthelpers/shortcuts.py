@@ -1,4 +1,5 @@
 # coding=utf-8
+import collections
 from PySide import QtGui, QtCore
 import pkg_resources
 from qthelpers.utils import p
@@ -149,16 +150,38 @@ def information(title, message, only_ok=False):
         QtGui.QMessageBox.Ok
 
 
+_get_item_dialogs = collections.OrderedDict()  # {(title, label, choices): FormDialog subclass}, most recent last
+get_item_cache_size = 16  # maximum number of dialog classes kept by `get_item`
+
+
 def get_item(title: str, label: str, choices: list, initial: object=None) -> object:
     from qthelpers.fields import ChoiceField
     from qthelpers.forms import FormDialog
 
-    class Dialog(FormDialog):
-        verbose_name = title
-        text_confirm = _('Select')
-        value = ChoiceField(verbose_name=label, choices=choices, default=initial)
-
-    values = Dialog.process(initial={'value': initial}, parent=p(None))
+    choices = list(choices)
+    try:
+        key = (str(title), str(label), tuple(choices))
+        dialog_class = _get_item_dialogs.get(key)
+    except TypeError:  # unhashable choices
+        key, dialog_class = None, None
+    if dialog_class is None:
+        class Dialog(FormDialog):
+            verbose_name = title
+            text_confirm = _('Select')
+            value = ChoiceField(verbose_name=label, choices=choices)
+            reuse_instance = key is not None
+
+        dialog_class = Dialog
+        if key is not None:
+            _get_item_dialogs[key] = dialog_class
+            if len(_get_item_dialogs) > get_item_cache_size:
+                old_key, old_dialog_class = _get_item_dialogs.popitem(last=False)
+                old_dialog_class.release_instance()
+    else:
+        _get_item_dialogs.move_to_end(key)
+    if initial is None and choices:
+        initial = choices[0][0]  # a reused dialog would keep its last selected choice
+    values = dialog_class.process(initial={'value': initial}, parent=p(None))
     if values is None:
         return None
     return values['value']
@@ -1,8 +1,12 @@
 # coding=utf-8
+import json
+import os
+import tempfile
 import unittest
 from qthelpers.exceptions import InvalidValueException
-from qthelpers.fields import CharField, IntegerField, FloatField, BooleanField
-from qthelpers.preferences import Preferences, Section
+from qthelpers.fields import CharField, IntegerField, FloatField, BooleanField, CompactFieldGroup, ListField, \
+    DictField, ArrayListField
+from qthelpers.preferences import Preferences, Section, SQLiteStorage, preferences
 
 __author__ = 'flanker'
 
@@ -19,6 +23,29 @@ class SamplePreferences(Preferences):
         bool_value = BooleanField(default=True)
 
 
+class ContainerPreferences(SamplePreferences):
+    class Section1(Section):  # merged with SamplePreferences.Section1
+        int_list = ListField(base_type=int)
+        dict_value = DictField(max_depth=2)
+
+
+class TemporaryPreferences(ContainerPreferences):
+    save_delay = 0.
+
+    def __init__(self):
+        super().__init__()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def application_settings_filenames(self):
+        return os.path.join(self.directory.name, 'home.plist'), os.path.join(self.directory.name, 'allusers.plist')
+
+
+class SampleRecord(CompactFieldGroup):
+    __slots__ = ()
+    str_value = CharField(default='my_str')
+    int_value = IntegerField(default=42, required=True)
+
+
 class PreferencesTest(unittest.TestCase):
 
     def test_generic(self):
@@ -27,6 +54,22 @@ class PreferencesTest(unittest.TestCase):
         self.assertEqual(pref.Section1._field_order, ['str_value', 'int_value', 'float_value', 'float_value_none',
                                                       'bool_value'])
 
+    def test_descriptors(self):
+        pref = SamplePreferences()
+        self.assertIsInstance(SamplePreferences.Section1.int_value, IntegerField)
+        self.assertIs(pref.Section1, pref._sections['Section1'])
+        pref.Section1.int_value = 12
+        self.assertEqual(pref.Section1._values['int_value'], 12)
+        self.assertEqual(SamplePreferences().Section1.int_value, 42)
+
+    def test_compact(self):
+        record = SampleRecord(initial={'int_value': 12})
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertEqual(record.int_value, 12)
+        record.str_value = 'other'
+        self.assertEqual(record.get_values(), {'str_value': 'other', 'int_value': 12})
+        self.assertRaises(InvalidValueException, setattr, record, 'int_value', None)
+
     def test_bool(self):
         pref = SamplePreferences()
 
@@ -73,7 +116,203 @@ class PreferencesTest(unittest.TestCase):
         pref.Section1.float_value_none = None
         self.assertIsNone(pref.Section1.float_value_none)
 
+    def test_json(self):
+        pref = ContainerPreferences()
+        pref.Section1.int_list = [1, 2, 3]
+        self.assertRaises(InvalidValueException, setattr, pref.Section1, 'int_list', [1, 'a'])
+        self.assertRaises(InvalidValueException, setattr, pref.Section1, 'int_list', [1, object()])
+        pref.Section1.dict_value = {'a': [1, 2.5, None, 'b']}
+        self.assertRaises(InvalidValueException, setattr, pref.Section1, 'dict_value', {'a': [[1]]})
+        self.assertRaises(InvalidValueException, setattr, pref.Section1, 'dict_value', {'a': {1, 2}})
+
+    def test_validate_many(self):
+        field = IntegerField(min_value=0, max_value=10)
+        self.assertEqual(field.validate_many([1, 10, 0]), {})
+        self.assertEqual(sorted(field.validate_many([1, None, -1, 11, 'a']).keys()), [1, 2, 3, 4])
+        self.assertRaises(InvalidValueException, field.is_valid, 11)
+        for field, values in ((IntegerField(min_value=0, max_value=10), [1, None, -1, 11, 'a', 3.5]),
+                              (CharField(min_length=1, max_length=3), ['', 'ab', 'abcd', None, 1]),
+                              (FloatField(required=False, max_value=1.), [None, 0.5, 2., 1])):
+            expected = {}
+            for index, value in enumerate(values):
+                try:
+                    field.is_valid(value)
+                except InvalidValueException as e:
+                    expected[index] = str(e)
+            self.assertEqual(field.validate_many(values), expected)  # the column checks report the same errors
+
+    def test_text(self):
+        for field, values in ((CharField(), ['', 'a\nb']), (IntegerField(), [0, -3, None]),
+                              (FloatField(), [1.5, None]), (BooleanField(), [True, False]),
+                              (ListField(), [[], [1, 'a', None]]), (DictField(), [{}, {'a': [1, 2.5]}])):
+            for value in values:
+                text = field.to_text(value)
+                self.assertIsInstance(text, str)
+                self.assertEqual(field.from_text(text), value)
+        self.assertRaises(ValueError, IntegerField().from_text, 'a')
+
+    def test_array_list(self):
+        field = ArrayListField(base_type=int, default=[1, 2], max_length=3)
+        value = field.default
+        value.append(3)
+        self.assertEqual(field.default.tolist(), [1, 2])
+        self.assertIsNot(field.default, field.default)
+        serialized = field.serialize(value)
+        self.assertIsInstance(serialized, str)
+        self.assertEqual(field.deserialize(serialized), value)
+        self.assertEqual(field.deserialize([4, 5]).tolist(), [4, 5])
+        self.assertEqual(field.from_text(field.to_text(value)), value)
+        self.assertTrue(field.is_valid(value))
+        value.append(4)
+        self.assertRaises(InvalidValueException, field.is_valid, value)
+        self.assertRaises(InvalidValueException, field.is_valid, [1, 2])
+        self.assertRaises(InvalidValueException, field.is_valid, ArrayListField(base_type=float).to_array([1.]))
+
+    def test_validators_changed(self):
+        def check_even(value):
+            if value % 2:
+                raise InvalidValueException('odd value')
+
+        field = IntegerField(min_value=0)
+        self.assertTrue(field.is_valid(3))
+        field.validators.append(check_even)
+        self.assertRaises(InvalidValueException, field.is_valid, 3)
+        self.assertEqual(field.validate_many([2, 3]), {1: 'odd value'})
+        field.validators = []
+        self.assertTrue(field.is_valid(3))
+
     def test_load(self):
         pref = SamplePreferences()
         pref.load()
         pref.save()
+
+    def test_save(self):
+        pref = TemporaryPreferences()
+        pref.save_delay = 60.  # only written by flush
+        pref.load()
+        self.assertFalse(pref.save())
+        pref.Section1.int_value = 12
+        pref.Section1.int_list = [1]
+        self.assertEqual(pref.Section1.get_modified_keys(), {'int_value', 'int_list'})
+        self.assertTrue(pref.save())
+        self.assertFalse(pref.save())
+        pref.Section1.int_list.append(3)  # modified in place
+        self.assertEqual(pref.Section1.get_modified_keys(), {'int_list'})
+        self.assertTrue(pref.save())
+        self.assertIsNot(pref._pending_values['Section1']['int_list'], pref.Section1.int_list)
+        pref.Section1.int_list.append(4)  # not saved yet
+        pref.flush()
+        self.assertIsNot(pref.get_storages()[0]._document['Section1']['int_list'], pref.Section1.int_list)
+        with open(pref.application_settings_filenames()[0]) as fd:
+            values = json.load(fd)['Section1']
+        self.assertEqual((values['int_list'], values['int_value']), ([1, 3], '12'))
+        self.assertEqual(sorted(os.listdir(pref.directory.name)), ['home.plist'])
+
+    def test_save_errors(self):
+        pref = TemporaryPreferences()
+        pref.save_delay = 60.  # only written by flush
+        filename = pref.application_settings_filenames()[0]
+        pref.Section1.int_value = 12
+        pref.save()
+        pref.flush()
+        os.chmod(filename, 0o640)
+        pref.Section1.int_value = 13
+        pref.save()
+        pref.flush()
+        self.assertEqual(os.stat(filename).st_mode & 0o777, 0o640)  # permissions are kept
+        os.remove(filename)
+        os.mkdir(filename)  # cannot be replaced by a file
+        pref.Section1.int_value = 14
+        pref.save()
+        self.assertRaises(OSError, pref.flush)
+        self.assertEqual(pref._pending_values, {'Section1': {'int_value': '14'}})  # written by the next save
+        os.rmdir(filename)
+        pref.flush()
+        with open(filename) as fd:
+            self.assertEqual(json.load(fd)['Section1']['int_value'], '14')
+
+    def test_sqlite_storage(self):
+        pref = TemporaryPreferences()
+        pref.storage_class = SQLiteStorage
+        pref.Section1.dict_value = {'a': [1]}
+        pref.save()
+        pref.flush()
+        storage = pref.get_storages()[0]
+        self.assertEqual(storage.read(), {'Section1': {'dict_value': '{"a": [1]}'}})  # JSON texts
+        storage.write_values({'Section1': {'int_value': '12'}})
+        self.assertEqual(storage.read(), {'Section1': {'dict_value': '{"a": [1]}', 'int_value': '"12"'}})
+        other = TemporaryPreferences()
+        other.directory = pref.directory
+        other.storage_class = SQLiteStorage
+        other.load()
+        self.assertEqual(other.Section1._stored_values, {'dict_value': '{"a": [1]}', 'int_value': '"12"'})
+        self.assertEqual(other.Section1.int_value, 12)
+        self.assertEqual(other.Section1._stored_values, {'dict_value': '{"a": [1]}'})  # only int_value is decoded
+        self.assertEqual(other.Section1.dict_value, {'a': [1]})
+        other.Section1.set_stored_values({'int_value': '"1'}, decode=storage.decode)
+        self.assertEqual(other.Section1.int_value, 42)  # invalid JSON text
+
+    def test_lazy_load(self):
+        pref = TemporaryPreferences()
+        pref.Section1.int_value = 12
+        pref.Section1.int_list = [1, 2]
+        pref.save()
+        pref.flush()
+        other = TemporaryPreferences()
+        other.directory = pref.directory
+        other.load()
+        self.assertEqual(other.Section1._stored_values, {'int_value': '12', 'int_list': [1, 2]})
+        self.assertEqual(other.Section1.int_value, 12)
+        self.assertEqual(other.Section1._stored_values, {'int_list': [1, 2]})
+        other.Section1.int_list.append(3)
+        self.assertEqual(other.Section1.get_modified_keys(), {'int_list'})
+        # invalid stored values are replaced by a copy of the default value
+        other.Section1.set_stored_values({'int_value': 'a', 'int_list': {'a': 1}, 'str_value': None})
+        with self.assertLogs('qthelpers.preferences', level='WARNING') as logs:
+            self.assertEqual((other.Section1.int_value, other.Section1.int_list, other.Section1.str_value),
+                             (42, [], 'my_str'))
+        self.assertEqual(len(logs.output), 3)
+        self.assertIn('Section1/int_value', logs.output[0])
+        self.assertIsNot(other.Section1.int_list, other.Section1._fields['int_list'].default)
+        self.assertEqual(other.Section1._stored_values, {})
+
+    def test_subscribe(self):
+        pref = SamplePreferences()
+        changes = []
+        pref.subscribe(lambda *args: changes.append(('key',) + args), 'Section1', 'int_value')
+        pref.Section1.subscribe(lambda *args: changes.append(('section',) + args))
+        pref.Section1.int_value = 1
+        pref.Section1.int_value = 2
+        pref.Section1.str_value = 'other'
+        pref._notifier.deliver()  # normally called by the event loop
+        self.assertEqual(changes, [('key', 'Section1', 'int_value', 2), ('section', 'Section1', 'int_value', 2),
+                                   ('section', 'Section1', 'str_value', 'other')])
+        pref._notifier.deliver()
+        self.assertEqual(len(changes), 3)
+
+    def test_subscriber_errors(self):
+        pref = SamplePreferences()
+        changes = []
+
+        def failing_callback(*args):
+            raise ValueError('failing subscriber')
+
+        pref.subscribe(failing_callback, 'Section1')
+        pref.subscribe(lambda *args: changes.append(args))
+        pref.Section1.int_value = 1
+        pref.Section1.str_value = 'other'
+        with self.assertLogs('qthelpers.preferences', 'ERROR'):
+            pref._notifier.deliver()
+        self.assertEqual(changes, [('Section1', 'int_value', 1), ('Section1', 'str_value', 'other')])
+        self.assertRaises(RuntimeError, SamplePreferences.Section1().subscribe, failing_callback)
+
+    def test_handles(self):
+        pref = SamplePreferences()  # also registered as the global `preferences` object
+        handle = pref.handle('Section1/int_value')
+        self.assertIs(handle, pref.handle('Section1/int_value'))
+        handle.set(12)
+        self.assertEqual((handle.get(), pref['Section1/int_value'], preferences['Section1/int_value']), (12, 12, 12))
+        preferences['Section1/int_value'] = 13
+        self.assertEqual(pref.Section1.int_value, 13)
+        self.assertRaises(InvalidValueException, handle.set, None)
+        self.assertRaises(KeyError, pref.handle, 'Section1/unknown')
@@ -0,0 +1,301 @@
+# coding=utf-8
+import unittest
+
+from PySide import QtTest
+
+from qthelpers.application import BaseApplication, application_key
+from qthelpers.fields import CharField, IntegerField, ComputedField
+from qthelpers.forms import BaseForm, Form, SubForm, FormName, TabbedMultiForm, VirtualForm
+from qthelpers.preferences import global_dict
+
+
+__author__ = 'flanker'
+
+
+class SampleApplication(BaseApplication):
+    verbose_name = 'Sample Application'
+    application_version = '0.1'
+
+
+computations = []  # names of the computed fields, in computation order
+reads = []  # names of the fields whose widget is read
+validations = []  # (field name, valid) given to `set_widget_valid`
+changes = []  # values given to `on_change`
+
+
+def compute(name: str, function: callable) -> callable:
+    def wrapper(*args):
+        computations.append(name)
+        return function(*args)
+    return wrapper
+
+
+class RecordingIntegerField(IntegerField):
+
+    def get_widget_value(self, widget) -> int:
+        reads.append(self.name)
+        return super().get_widget_value(widget)
+
+    def set_widget_valid(self, widget, valid: bool, msg: str):
+        validations.append((self.name, valid))
+        super().set_widget_valid(widget, valid, msg)
+
+
+class RatioForm(BaseForm):
+    a = IntegerField(default=1)
+    b = IntegerField(default=0)
+    ratio = ComputedField(lambda a, b: a / b, depends_on=('a', 'b'))
+
+
+class TotalForm(Form):
+    a = IntegerField(default=1)
+    b = IntegerField(default=2)
+    c = IntegerField(default=0)
+    total = ComputedField(compute('total', lambda a, b: a + b), depends_on=('a', 'b'))
+    double = ComputedField(compute('double', lambda total, c: 2 * total + c), depends_on=('total', 'c'))
+
+
+class LiveForm(Form):
+    live_validation_delay = 10
+    a = RecordingIntegerField(default=1, min_value=0, on_change=lambda form, widget, value: changes.append(value))
+    b = RecordingIntegerField(default=2)
+
+
+class TrackedForm(Form):
+    live_validation = False
+    a = RecordingIntegerField(default=1)
+    b = RecordingIntegerField(default=2)
+
+
+class PagesForm(Form):
+    name = CharField(default='n')
+
+    class Pages(TabbedMultiForm):
+        verbose_name = FormName('pages')
+
+        class First(SubForm):
+            verbose_name = FormName('first')
+            x = IntegerField(default=1)
+
+        class Second(SubForm):
+            verbose_name = FormName('second')
+            y = IntegerField(default=2, min_value=0)
+
+
+class LongForm(VirtualForm):
+    live_validation = False
+    row_height = 20
+    overscan = 2
+    for index in range(50):
+        locals()['f%02d' % index] = RecordingIntegerField(default=index, min_value=0)
+    del index
+
+
+def setUpModule():
+    if global_dict.get(application_key) is None:  # the application may have been created by another test module
+        SampleApplication([])
+
+
+class ComputedFieldTest(unittest.TestCase):
+
+    def setUp(self):
+        del computations[:]
+
+    def test_lazy_computation(self):
+        form = RatioForm()  # ratio is not computed by the constructor
+        self.assertRaises(ZeroDivisionError, getattr, form, 'ratio')
+        form.b = 4
+        self.assertEqual(form.ratio, 0.25)
+        self.assertEqual(form.get_changed_values(), {'b': 4})  # computed fields are not compared
+
+    def test_invalidation_order(self):
+        form = TotalForm()
+        self.assertEqual(computations, ['total', 'double'])  # displayed by the form widgets
+        del computations[:]
+        form.c = 1
+        self.assertEqual(form.double, 7)
+        self.assertEqual(computations, ['double'])  # total does not depend on c
+        del computations[:]
+        form.a = 2
+        self.assertEqual(computations, ['total', 'double'])  # widgets are updated in dependency order
+        self.assertEqual((form.total, form.double), (4, 9))
+        self.assertEqual(computations, ['total', 'double'])  # values are kept until the next modification
+
+    def test_widget_updates(self):
+        form = TotalForm()
+        self.assertEqual(form.get_widget('double').text(), '6')
+        form.get_widget('a').setText('5')
+        self.assertEqual(form.get_widget('double').text(), '6')  # updated when the edition pauses
+        form._validate_touched_fields()  # normally called by the live validation timer
+        self.assertEqual((form.get_widget('total').text(), form.get_widget('double').text()), ('7', '14'))
+        form.get_widget('c').setText('1')
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.get_widget('double').text(), '15')
+        self.assertEqual(form.get_values(), {'a': 5, 'b': 2, 'c': 1, 'total': 7, 'double': 15})
+        self.assertEqual(form.get_changed_values(), {'a': 5, 'c': 1})
+
+
+class LiveValidationTest(unittest.TestCase):
+
+    def setUp(self):
+        for records in reads, validations, changes:
+            del records[:]
+
+    def test_touched_fields(self):
+        form = LiveForm()
+        widget = form.get_widget('a')
+        widget.setText('3')
+        widget.setText('-4')
+        self.assertEqual(form._touched_fields, {'a'})
+        self.assertEqual(validations, [])  # nothing is validated while the user is typing
+        self.assertTrue(form._live_validation_timer.isActive())
+        QtTest.QTest.qWait(100)
+        self.assertEqual(form._touched_fields, set())
+        self.assertEqual(reads, ['a'])  # b has not been touched
+        self.assertEqual(validations, [('a', False)])
+        self.assertEqual(changes, [-4])  # a single call for the whole settle period
+        widget.setText('5')
+        QtTest.QTest.qWait(100)
+        self.assertEqual(validations, [('a', False), ('a', True)])
+        self.assertEqual(changes, [-4, 5])
+        self.assertEqual(form.a, 1)  # values are only stored by `is_valid`
+        self.assertIn('a', form._dirty_fields)
+
+
+class DirtyTrackingTest(unittest.TestCase):
+
+    def setUp(self):
+        del reads[:]
+
+    def test_only_dirty_fields_are_read(self):
+        form = TrackedForm()
+        self.assertTrue(form.is_valid())
+        self.assertEqual(sorted(reads), ['a', 'b'])  # all widgets are read by the first call
+        del reads[:]
+        self.assertTrue(form.is_valid())
+        self.assertEqual(reads, [])
+        form.get_widget('b').setText('5')
+        self.assertTrue(form.is_valid())
+        self.assertEqual(reads, ['b'])
+        del reads[:]
+        form.set_values({'a': 7})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(reads, ['a'])
+        self.assertEqual(form.get_values(), {'a': 7, 'b': 5})
+
+    def test_changed_values(self):
+        form = TrackedForm(initial={'a': 3})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.get_changed_values(), {})
+        form.get_widget('a').setText('4')
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.get_changed_values(), {'a': 4})
+        form.snapshot()
+        self.assertEqual(form.get_changed_values(), {})
+        form.get_widget('b').setText('6')
+        form.get_widget('a').setText('3')
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.get_changed_values(), {'a': 3, 'b': 6})  # compared to the snapshot
+        form.reset()
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.get_changed_values(), {})
+
+
+class LazySubFormTest(unittest.TestCase):
+
+    def test_pages_built_when_shown(self):
+        form = PagesForm()
+        pages = form.get_multiform('Pages')
+        self.assertEqual((pages.First.subform, pages.Second.subform), (None, None))
+        form.show()
+        self.assertIsNotNone(pages.First.subform)  # current page
+        self.assertIsNone(pages.Second.subform)
+        pages.setCurrentIndex(1)
+        self.assertIsNotNone(pages.Second.subform)
+        form.close()
+
+    def test_values_of_pages_never_opened(self):
+        form = PagesForm(initial={'y': 3})
+        pages = form.get_multiform('Pages')
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.get_values(), {'name': 'n', 'x': 1, 'y': 3})
+        pages.set_values({'x': 4})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.get_values(), {'name': 'n', 'x': 4, 'y': 3})
+        self.assertEqual((pages.First.subform, pages.Second.subform), (None, None))
+
+    def test_invalid_page(self):
+        form = PagesForm(initial={'y': -1})
+        pages = form.get_multiform('Pages')
+        self.assertFalse(form.is_valid())
+        self.assertIsNone(pages.First.subform)  # valid pages are still not built
+        self.assertIsNotNone(pages.Second.subform)  # built to display the invalid field
+        self.assertEqual(pages.currentIndex(), 1)
+        self.assertIn('y', pages.Second.subform._invalid_fields)
+
+
+class VirtualFormTest(unittest.TestCase):
+
+    def setUp(self):
+        del validations[:]
+        self.form = LongForm()
+        self.form.resize(400, 200)
+        self.form.show()
+
+    def tearDown(self):
+        self.form.close()
+
+    def scroll_to(self, row: int):
+        self.form.verticalScrollBar().setValue(row * self.form.row_height)
+
+    def assertRealisedRows(self, first_row: int):
+        form = self.form
+        last_row = min(50, first_row + form.viewport().height() // form.row_height + 1 + form.overscan)
+        rows = set(range(max(0, first_row - form.overscan), last_row))
+        self.assertEqual(set(form._realised_rows) - form._pinned_rows, rows - form._pinned_rows)
+        self.assertEqual(set(form.get_widgets()), {form._row_fields[row] for row in form._realised_rows})
+
+    def test_scroll(self):
+        self.assertRealisedRows(0)
+        self.assertLess(len(self.form._realised_rows), 20)
+        self.scroll_to(20)
+        self.assertRealisedRows(20)
+        self.scroll_to(40)
+        self.assertRealisedRows(self.form.verticalScrollBar().value() // self.form.row_height)
+        self.assertNotIn(0, self.form._realised_rows)
+
+    def test_pinned_invalid_row(self):
+        form = self.form
+        form.get_widget('f00').setText('-1')
+        self.scroll_to(30)
+        self.assertEqual(form._pinned_rows, {0})  # the invalid value cannot be stored
+        self.assertIn(0, form._realised_rows)
+        self.assertIn('f00', form._invalid_fields)
+        self.assertRealisedRows(30)
+        self.assertFalse(form.is_valid())
+        form.get_widget('f00').setText('5')
+        self.scroll_to(40)
+        self.assertEqual(form._pinned_rows, set())
+        self.assertNotIn(0, form._realised_rows)
+        self.assertEqual(form.f00, 5)
+        self.assertTrue(form.is_valid())
+
+    def test_unrealised_rows(self):
+        form = self.form
+        form.set_values({'f45': 7, 'f46': -3})
+        self.assertNotIn('f45', form.get_widgets())
+        self.assertEqual(form.f45, 7)
+        self.assertFalse(form.is_valid())  # validated without any widget
+        self.assertEqual(form._invalid_fields.keys(), {'f46'})
+        self.assertNotIn('f46', form.get_widgets())
+        self.assertEqual(validations, [])
+        self.scroll_to(45)
+        self.assertEqual(form.get_widget('f45').text(), '7')
+        self.assertIn(('f46', False), validations)  # the new widget displays the error
+        form.get_widget('f46').setText('8')
+        self.assertTrue(form.is_valid())
+        self.assertEqual((form.f45, form.f46, form.f00), (7, 8, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+# coding=utf-8
+import io
+import unittest
+
+from PySide import QtCore, QtGui
+
+from qthelpers.application import BaseApplication, application_key
+from qthelpers.exceptions import InvalidValueException
+from qthelpers.fields import CharField, IntegerField
+from qthelpers.forms import Formset, ModelFormset, FormDialog, _dialog_pool
+from qthelpers.preferences import global_dict
+
+
+__author__ = 'flanker'
+
+
+class SampleApplication(BaseApplication):
+    verbose_name = 'Sample Application'
+    application_version = '0.1'
+
+
+class SampleFormset(Formset):
+    name = CharField(default='')
+    quantity = IntegerField(default=0, min_value=0)
+
+
+class SampleModelFormset(ModelFormset):
+    name = CharField(default='')
+    quantity = IntegerField(default=0, min_value=0)
+
+
+class SampleDialog(FormDialog):
+    name = CharField(default='')
+
+
+class AcceptedDialog(SampleDialog):
+    reuse_instance = True
+
+    def exec_(self):
+        self.is_valid()
+        return QtGui.QDialog.Accepted
+
+
+class RecyclingFormset(SampleFormset):
+    recycle_widgets = True
+    item_pool_size = 1
+
+
+def setUpModule():
+    if global_dict.get(application_key) is None:  # the application may have been created by another test module
+        SampleApplication([])
+
+
+class FormsetTest(unittest.TestCase):
+
+    def test_formset(self):
+        formset = SampleFormset(initial=[{'name': 'a', 'quantity': 1}])
+        self.assertEqual(formset.item_count(), 1)
+        formset.extend([{'name': 'b'}, {'name': 'c', 'quantity': 3}])
+        self.assertEqual(formset.get_values(), [{'name': 'a', 'quantity': 1}, {'name': 'b', 'quantity': 0},
+                                                {'name': 'c', 'quantity': 3}])
+        formset.remove_range(0, 2)
+        self.assertEqual(formset.get_values(), [{'name': 'c', 'quantity': 3}])
+        self.assertTrue(formset.is_valid())
+
+    def test_model_formset(self):
+        formset = SampleModelFormset(initial=[{'name': 'a', 'quantity': 1}])
+        self.assertEqual(formset.item_count(), 1)
+        formset.extend([{'name': 'b'}, {'name': 'c', 'quantity': -3}])
+        self.assertEqual(formset.get_values(), [{'name': 'a', 'quantity': 1}, {'name': 'b', 'quantity': 0},
+                                                {'name': 'c', 'quantity': -3}])
+        self.assertFalse(formset.is_valid())
+        self.assertEqual(list(formset.get_errors()), [(2, 1)])
+        formset.remove_range(0, 1)
+        self.assertEqual(formset.item_count(), 2)
+
+    def test_recycle_widgets(self):
+        formset = RecyclingFormset(initial=[{'name': 'a', 'quantity': 1}, {'name': 'b', 'quantity': 2}])
+        self.assertEqual(formset.get_widget_counters(), {'created': 4, 'reused': 0, 'released': 0, 'deleted': 0,
+                                                         'pooled': 0})
+        item = formset.topLevelItem(0)
+        widget = formset.get_item_widget(item, 0)
+        formset.remove_range(0, 2)
+        QtCore.QCoreApplication.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+        # only one item is kept with its widgets
+        self.assertEqual(formset.get_widget_counters(), {'created': 4, 'reused': 0, 'released': 2, 'deleted': 2,
+                                                         'pooled': 2})
+        formset.insert_item({'name': 'c', 'quantity': 3})
+        formset.insert_item({'name': 'd'}, index=0)
+        self.assertEqual(formset.get_widget_counters(), {'created': 6, 'reused': 2, 'released': 2, 'deleted': 2,
+                                                         'pooled': 0})
+        self.assertIs(formset.topLevelItem(1), item)
+        self.assertIs(formset.itemWidget(item, 0), widget)  # displayed without any container
+        self.assertEqual(formset.get_values(), [{'name': 'd', 'quantity': 0}, {'name': 'c', 'quantity': 3}])
+        widget.setText('e')
+        self.assertIn(item, formset._modified_items)
+        formset.remove_item(formset.topLevelItem(0))
+        formset.replace_all([{'name': 'f'}])  # reuses the removed item
+        QtCore.QCoreApplication.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+        self.assertEqual(formset.get_widget_counters(), {'created': 6, 'reused': 4, 'released': 4, 'deleted': 4,
+                                                         'pooled': 0})
+        self.assertEqual(formset.get_values(), [{'name': 'f', 'quantity': 0}])
+
+    def test_model_formset_editor(self):
+        formset = SampleModelFormset(initial=[{'name': 'a', 'quantity': 1}])
+        formset.show()
+        index = formset.model().index(0, 0)
+        formset.edit(index)
+        editor = formset.indexWidget(index)
+        self.assertIsNotNone(editor)
+        self.assertIs(editor.parentWidget(), formset.viewport())
+        formset.close()
+
+    def test_csv(self):
+        for cls in SampleFormset, SampleModelFormset:
+            formset = cls(initial=[{'name': 'a, "b"', 'quantity': 1}, {'name': '', 'quantity': 0}])
+            csv_file = io.StringIO(newline='')
+            formset.export_csv(csv_file)
+            self.assertEqual(csv_file.getvalue().splitlines()[0], 'name,quantity')
+            imported = cls()
+            csv_file.seek(0)
+            self.assertEqual(imported.import_csv(csv_file), 2)
+            self.assertEqual(imported.get_values(), formset.get_values())
+            csv_file = io.StringIO('quantity\n2\n-1\n', newline='')
+            self.assertRaises(InvalidValueException, imported.import_csv, csv_file)  # rejected by min_value
+            csv_file = io.StringIO('quantity\n2\nb\n', newline='')
+            self.assertRaises(InvalidValueException, imported.import_csv, csv_file)
+            self.assertEqual(imported.item_count(), 2)
+
+    def test_validate_in_background(self):
+        def cancellable_call(thread_callable, result_callable, *args):
+            # same calls as ThreadedCalls.cancellable_call, without thread
+            result_callable(thread_callable(*args), *args)
+
+        for cls in SampleFormset, SampleModelFormset:
+            formset = cls(initial=[{'name': 'a', 'quantity': 1}, {'name': 'b', 'quantity': -1}])
+            formset.cancellable_call = cancellable_call
+            formset.validation_thread_threshold = 0
+            results = []
+            formset.validation_finished.connect(results.append)
+            formset.validate_in_background()
+            self.assertEqual(results, [False])
+            self.assertIsNone(formset._pending_validation)
+
+    def test_feed_error(self):
+        def rows():
+            yield {'name': 'a'}
+            raise ValueError('unreadable row')
+
+        formset = SampleFormset()
+        finished = []
+        formset.feed_finished.connect(finished.append)
+        formset.feed(rows())
+        self.assertRaises(ValueError, formset._feed_step)
+        self.assertFalse(formset.is_feeding())
+        self.assertEqual(finished, [False])
+        formset.feed([], threaded=True)
+        self.assertRaises(ValueError, formset._feed_received, formset._feed_id, None, ValueError('unreadable row'))
+        self.assertFalse(formset.is_feeding())
+
+
+class FormDialogTest(unittest.TestCase):
+
+    def test_dialog_pool(self):
+        dialog = SampleDialog.get_instance(initial={'name': 'a'})
+        self.assertIs(SampleDialog.get_instance(initial={'name': 'b'}), dialog)
+        self.assertTrue(dialog.is_valid())
+        self.assertEqual(dialog.get_values(), {'name': 'b'})
+        dialog.deleteLater()
+        QtCore.QCoreApplication.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+        self.assertNotIn(SampleDialog, _dialog_pool)  # destroyed dialogs are removed from the pool
+        self.assertIsNot(SampleDialog.get_instance(), dialog)
+        SampleDialog.release_instance()
+        self.assertNotIn(SampleDialog, _dialog_pool)
+
+    def test_process(self):
+        self.assertFalse(SampleDialog.reuse_instance)  # pooling is opt-in
+        first = AcceptedDialog.process(initial={'name': 'a'})
+        second = AcceptedDialog.process(initial={'name': 'b'})
+        self.assertEqual((first, second), ({'name': 'a'}, {'name': 'b'}))  # results are not modified by reuse
+        self.assertIn(AcceptedDialog, _dialog_pool)
+        AcceptedDialog.release_instance()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# coding=utf-8
+import unittest
+
+from PySide import QtCore
+
+from qthelpers.fields import CharField, IntegerField
+from qthelpers.models import ChoiceListModel, FormsetModel, FormsetProxyModel
+
+
+__author__ = 'flanker'
+
+
+class ChoiceListModelTest(unittest.TestCase):
+
+    def test_row_of_value(self):
+        model = ChoiceListModel([(1, 'one'), (True, 'true'), (0, 'zero'), (False, 'false'), ([1], 'list')])
+        self.assertEqual(model.rowCount(), 5)
+        self.assertEqual([model.row_of_value(value) for value in (1, True, 0, False, [1])], [0, 1, 2, 3, 4])
+        self.assertEqual(model.row_of_value(1.), -1)
+        self.assertEqual(model.row_of_value([2]), -1)
+        self.assertEqual(model.row_of_value(None), -1)
+        self.assertEqual(model.row_of_text('false'), 3)
+        self.assertIs(model.value(1), True)
+        self.assertEqual(model.text(0), 'one')
+
+
+class FormsetProxyModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fields = {'name': CharField(default=''), 'quantity': IntegerField(default=0)}
+        for field_name, field in self.fields.items():
+            field.name = field_name
+        rows = [{'name': name, 'quantity': index} for (index, name) in enumerate(['pear', 'apple', 'peach', 'plum'])]
+        self.source = FormsetModel(self.fields, ['name', 'quantity'], rows)
+        self.proxy = FormsetProxyModel(self.source)
+
+    def get_names(self, proxy=None):
+        proxy = proxy or self.proxy
+        return [proxy.data(proxy.index(row, 0)) for row in range(proxy.rowCount())]
+
+    def assert_consistent(self):
+        """ Once sorted and filtered again, the proxy must display the same rows as a new proxy """
+        proxy = FormsetProxyModel(self.source)
+        proxy.set_filter_text(self.proxy._filter_text)
+        proxy.sort(self.proxy._sort_column, self.proxy._sort_order)
+        self.proxy.set_filter_text(self.proxy._filter_text)
+        self.assertEqual(self.get_names(), self.get_names(proxy))
+
+    def test_sort_persistent_indexes(self):
+        index = QtCore.QPersistentModelIndex(self.proxy.index(1, 1))
+        self.assertEqual(self.proxy.data(index), '1')
+        self.proxy.sort(0)
+        self.assertEqual(self.get_names(), ['apple', 'peach', 'pear', 'plum'])
+        self.assertEqual((index.row(), index.column()), (0, 1))
+        self.proxy.sort(0, QtCore.Qt.DescendingOrder)
+        self.assertEqual(index.row(), 3)
+        self.proxy.sort(-1)
+        self.assertEqual(index.row(), 1)
+
+    def test_insert_remove(self):
+        self.proxy.set_filter_text('pe')
+        self.proxy.sort(0)
+        self.assertEqual(self.get_names(), ['peach', 'pear'])
+        self.source.insert_rows(1, [{'name': 'apricot'}, {'name': 'pepper'}])
+        self.assertEqual(self.get_names(), ['peach', 'pear', 'apricot', 'pepper'])  # new rows are not hidden
+        self.assert_consistent()
+        self.assertEqual(self.get_names(), ['peach', 'pear', 'pepper'])
+        self.source.remove_rows(0, 3)
+        self.assertEqual(self.get_names(), ['peach'])
+        self.assert_consistent()
+        self.proxy.sort(-1)
+        self.proxy.set_filter_text('h')
+        self.assertEqual(self.get_names(), ['peach'])
+        self.source.insert_rows(1, [{'name': 'cherry'}])
+        self.assertEqual(self.get_names(), ['cherry', 'peach'])
+        self.assert_consistent()
+        self.assertEqual(self.get_names(), ['cherry', 'peach'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,39 @@ def p(obj):
     return application.parent
 
 
+def class_members(cls: type, accept) -> list:
+    """ Walk the whole class hierarchy of `cls` and return the list of (name, value) for attributes accepted by
+    `accept(name, value)`. When an attribute is overriden in a subclass, only the first accepted one is kept.
+    :param cls: class to inspect
+    :param accept: callable(name, value) -> bool
+    :return: list of (name, value)
+    """
+    members = []
+    seen = set()
+    for base in cls.__mro__:
+        for name, value in base.__dict__.items():
+            if name in seen or not accept(name, value):
+                continue
+            seen.add(name)
+            members.append((name, value))
+    return members
+
+
+def get_schema(cls: type, schema_class: type):
+    """ Return the schema of `cls`, computing it on the first call.
+    The schema is stored in the class itself (not inherited by subclasses), so introspection of the class hierarchy
+    is only done once per class and its result is shared by all instances.
+    :param cls: class to describe
+    :param schema_class: callable(cls) -> schema
+    :return: instance of `schema_class`
+    """
+    schema = cls.__dict__.get('_schema')
+    if schema is None:
+        schema = schema_class(cls)
+        cls._schema = schema
+    return schema
+
+
 class ThreadedCalls(object):
     _generic_signal = QtCore.Signal(list)
 
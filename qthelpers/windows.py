@@ -3,10 +3,8 @@ import base64
 import functools
 import itertools
 import os
-import threading
 
 from PySide import QtGui, QtCore
-import time
 
 from qthelpers.application import application
 from qthelpers.docks import BaseDock
@@ -154,12 +152,14 @@ class BaseMainWindow(QtGui.QMainWindow, ThreadedCalls):
         self.adjustSize()
         try:
             cls_name = self.__class__.__name__
-            if cls_name in application['GlobalInfos/main_window_geometries']:
-                geometry_str = application['GlobalInfos/main_window_geometries'][cls_name].encode('utf-8')
+            geometries = application.handle('GlobalInfos/main_window_geometries').get()
+            if cls_name in geometries:
+                geometry_str = geometries[cls_name].encode('utf-8')
                 geometry = base64.b64decode(geometry_str)
                 self.restoreGeometry(geometry)
-            if cls_name in application['GlobalInfos/main_window_states']:
-                state_str = application['GlobalInfos/main_window_states'][cls_name].encode('utf-8')
+            states = application.handle('GlobalInfos/main_window_states').get()
+            if cls_name in states:
+                state_str = states[cls_name].encode('utf-8')
                 state = base64.b64decode(state_str)
                 self.restoreState(state)
         except ValueError:
@@ -183,12 +183,19 @@ class BaseMainWindow(QtGui.QMainWindow, ThreadedCalls):
         geometry = bytes(geometry.data())
         str_geometry = base64.b64encode(geometry).decode('utf-8')  # automatically save window geometry
         """:type: str"""
-        application['GlobalInfos/main_window_geometries'][cls_name] = str_geometry
+        # modified dicts are assigned again, so that preferences know they have been modified
+        geometries_handle = application.handle('GlobalInfos/main_window_geometries')
+        geometries = dict(geometries_handle.get())
+        geometries[cls_name] = str_geometry
+        geometries_handle.set(geometries)
         state = self.saveState()
         state = bytes(state.data())
         str_state = base64.b64encode(state).decode('utf-8')  # automatically save window state
-        application['GlobalInfos/main_window_states'][cls_name] = str_state
         """:type: str"""
+        states_handle = application.handle('GlobalInfos/main_window_states')
+        states = dict(states_handle.get())
+        states[cls_name] = str_state
+        states_handle.set(states)
         del application.windows[self._window_id]
         super().closeEvent(event)
 
@@ -210,15 +217,19 @@ class SingleDocumentWindow(BaseMainWindow):
             self.base_open_document(filename)
         else:
             self.base_new_document()
-        auto_save = threading.Thread(target=self.base_auto_save_thread, name='auto_save')
-        auto_save.start()
-        self.base_threads.append(auto_save)
+        self._base_auto_save_timer = QtCore.QTimer(p(self))
+        # noinspection PyUnresolvedReferences
+        self._base_auto_save_timer.timeout.connect(self.base_auto_save)
+        self.base_auto_save_interval_changed()
+        application.subscribe(self.base_auto_save_interval_changed, 'GlobalInfos', 'auto_save_interval')
 
     def closeEvent(self, event: QtCore.QEvent):
         if self._base_check_is_modified():
             event.ignore()
             return
         self.unload_document()
+        application.unsubscribe(self.base_auto_save_interval_changed, 'GlobalInfos', 'auto_save_interval')
+        self._base_auto_save_timer.stop()
         self.base_stop_threads = True
         for thread in self.base_threads:
             thread.join()
@@ -244,21 +255,17 @@ class SingleDocumentWindow(BaseMainWindow):
         """:type: QtGui.QStatusBar"""
         status.showMessage(message, msecs)
 
-    def base_auto_save_thread(self):
-        while True:
-            interval = application.GlobalInfos.auto_save_interval
-            if interval <= 0:
-                for i in range(10):
-                    if self.base_stop_threads:
-                        return
-                    time.sleep(1)
-            else:
-                for i in range(interval):
-                    if self.base_stop_threads:
-                        return
-                    time.sleep(1)
-                if self.current_document_filename:
-                    self.signal_call(self.base_save_document)
+    def base_auto_save_interval_changed(self, *args):
+        """ Called when the auto-save interval (in seconds, 0 to disable) is modified """
+        interval = application.GlobalInfos.auto_save_interval
+        if interval > 0:
+            self._base_auto_save_timer.start(interval * 1000)
+        else:
+            self._base_auto_save_timer.stop()
+
+    def base_auto_save(self):
+        if self.current_document_filename:
+            self.base_save_document()
 
     @menu_item(verbose_name=_('New document'), menu=_('File'), shortcut='Ctrl+N')
     @toolbar_item(verbose_name=_('New document'), icon='document-new')
@@ -380,9 +387,8 @@ class SingleDocumentWindow(BaseMainWindow):
         for filename in application.GlobalInfos.last_documents:
             if filename == new_filename:
                 return
-        application.GlobalInfos.last_documents.insert(0, new_filename)
-        while len(application.GlobalInfos.last_documents) > self.base_max_recent_documents:
-            del application.GlobalInfos.last_documents[self.base_max_recent_documents]
+        last_documents = [new_filename] + application.GlobalInfos.last_documents
+        application.GlobalInfos.last_documents = last_documents[:self.base_max_recent_documents]
 
     def base_mark_document_as_modified(self, modified=True):
         if not self.current_document_is_modified and modified: